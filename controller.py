@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+from meshlab.controller import Controller, ControllerClient, RequestError, default_socket_path
+from meshlab.lab import Topology, Lab, get_data_plane
+from meshlab import tracing
+from meshlab import common
+from meshlab import names
+import argparse
+import random
+import json
+import sys
+import os
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description='Controller that keeps the lab state in one process and accepts commands over a Unix socket:\n'
+        ' ./controller.py serve --topology graph.json &\n'
+        ' ./controller.py call delta \'{"remove": [["a", "b"]]}\'\n'
+        ' ./controller.py call start \'{"protocol": "babel"}\'\n'
+        ' ./controller.py call probe \'{"samples": 100, "duration_ms": 5000}\'')
+parser.add_argument('--lab', help='Lab instance, see network.py --lab. Default: the default lab')
+parser.add_argument('--socket', help='Unix socket of the controller. Default: {} (/tmp/meshnet-<lab>-controller.sock)'.format(default_socket_path))
+
+subparsers = parser.add_subparsers(dest='action', required=True)
+
+parser_serve = subparsers.add_parser('serve', help='Run the controller until the "shutdown" command.')
+parser_serve.add_argument('--topology', default='none', help='JSON file of the network that already exists. Default: none')
+parser_serve.add_argument('--verbosity', choices=['verbose', 'normal', 'quiet'], default='quiet', help='Output of the controller. Default: quiet')
+parser_serve.add_argument('--seed', type=int, help='Seed for the random number generator.')
+parser_serve.add_argument('--cpus', help='Run on these CPUs only (like taskset), e.g. "0-7". Started daemons inherit the set.')
+parser_serve.add_argument('--journal', help='Journal file of the running change, used for rollback. Default: /tmp/meshnet-network.journal (/tmp/meshnet-<lab>-network.journal)')
+parser_serve.add_argument('--names', help='Mapping of long node names to short ids. Default: /tmp/meshnet-names.json (/tmp/meshnet-<lab>-names.json)')
+parser_serve.add_argument('--data-plane', choices=['bridge', 'mirred'], help='Data plane of new networks, see network.py. Default: the data plane of the existing network, else bridge')
+parser_serve.add_argument('--trace', metavar='FILE', help='Write timing spans of all commands as Chrome trace JSON on shutdown.')
+
+parser_call = subparsers.add_parser('call', help='Send one command and print the result as JSON.')
+parser_call.add_argument('method', help='status, change, delta, set_tc, start, stop, probe, traffic, reachability, counters or shutdown')
+parser_call.add_argument('params', nargs='?', default='{}', help='Parameters as JSON object.')
+
+args = parser.parse_args()
+
+if args.lab is not None and not common.is_lab_name(args.lab):
+    sys.stderr.write('Invalid lab name: {}\n'.format(args.lab))
+    exit(1)
+
+common.set_lab(args.lab)
+socket_path = args.socket or common.get_state_path('controller.sock')
+
+if args.action == 'call':
+    try:
+        params = json.loads(args.params)
+        client = ControllerClient(socket_path)
+        print(json.dumps(client.call(args.method, **params), indent=1))
+        client.close()
+    except (OSError, ValueError, RequestError) as e:
+        sys.stderr.write('{}\n'.format(e))
+        exit(1)
+    exit(0)
+
+if os.geteuid() != 0:
+    print('Need to run as root.')
+    exit(1)
+
+if args.cpus is not None:
+    try:
+        common.set_cpus(args.cpus)
+    except common.LabError as e:
+        print(e)
+        exit(1)
+
+random.seed(args.seed)
+
+common.verbosity = args.verbosity
+common.tracer = tracing.Tracer(args.trace)
+common.name_map = names.NameMap(args.names or common.get_state_path('names.json'))
+
+data_plane = get_data_plane()
+if args.data_plane is not None and data_plane is not None and args.data_plane != data_plane:
+    print('The existing network uses data plane "{}".'.format(data_plane))
+    exit(1)
+common.data_plane = args.data_plane or data_plane or 'bridge'
+
+lab = Lab(args.journal, args.names)
+# shared with the probes for display names
+lab.name_map = common.name_map
+
+if lab.has_journal():
+    print('Journal of an interrupted change found: {}'.format(lab.journal_path))
+    print('Use "./network.py rollback" to undo it or remove the file.')
+    exit(1)
+
+try:
+    topology = Topology.load(args.topology)
+except (OSError, ValueError) as e:
+    print('{}: {}'.format(args.topology, e))
+    exit(1)
+
+Controller(lab, topology).serve(socket_path)
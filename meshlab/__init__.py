@@ -0,0 +1,21 @@
+'''
+Library of the mesh network lab, network.py and tests.py are
+thin command line wrappers. A sweep can keep one process (and its
+namespace workers, caches and sockets) over many steps, e.g.:
+
+  from meshlab import Topology, Lab, Protocol, Probe
+
+  lab = Lab()
+  lab.change(Topology.load('none'), Topology.load('graph.json'))
+  protocol = Protocol('babel')
+  protocol.start(lab.get_nsnames())
+  result = Probe(lab.get_nsnames(), protocol.interface).run(path_count = 100)
+  protocol.stop(lab.get_nsnames())
+  lab.clear()
+
+Shared settings (verbosity, tracer, ...) are in meshlab.common.
+'''
+
+from .lab import Topology, Lab, Task, CommandError
+from .protocols import Protocol
+from .probes import Probe
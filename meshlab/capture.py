@@ -0,0 +1,273 @@
+'''
+Sampled packet capture on the interfaces of namespace "switch"
+with a memory mapped packet ring (TPACKET_V3) and a socket filter.
+'''
+
+import multiprocessing.connection
+import multiprocessing
+import fnmatch
+import ctypes
+import select
+import socket
+import struct
+import mmap
+import time
+import os
+
+from .common import LabError, add_csv_header, format_bytes
+from .namespaces import setns
+from . import common
+
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+PACKET_OUTGOING = 4
+SO_ATTACH_FILTER = 26
+# ancillary data offsets for classic BPF loads
+SKF_AD_OFF = -0x1000
+SKF_AD_PKTTYPE = 4
+SKF_AD_RANDOM = 56
+
+# protocol names by ethertype and by UDP port
+ethertype_names = {0x4305: 'batman-adv', 0x0806: 'arp', 0x0800: 'ipv4', 0x86dd: 'ipv6'}
+udp_port_names = {6696: 'babel', 269: 'olsr2', 698: 'olsr', 6240: 'bmx6/bmx7', 9001: 'yggdrasil'}
+ip_proto_names = {6: 'tcp', 17: 'udp', 1: 'icmp', 58: 'icmpv6'}
+
+'''
+Read a classic BPF program as printed by "tcpdump -ddd <expression>":
+the number of instructions followed by one "code jt jf k" line each.
+'''
+def parse_bpf(text):
+    lines = [line.split() for line in text.replace(',', '\n').split('\n') if len(line.strip()) > 0]
+    try:
+        program = [tuple(int(v) for v in line) for line in lines[1:]]
+        if len(lines) == 0 or int(lines[0][0]) != len(program) or any(len(insn) != 4 for insn in program):
+            raise ValueError()
+    except ValueError:
+        raise LabError('invalid BPF program (expected output of tcpdump -ddd)')
+    return program
+
+'''
+Build the socket filter: drop outgoing packets (every packet is
+seen once on the receiving interface), keep a random 1-in-N sample
+and truncate to snaplen. An optional user program follows.
+'''
+def get_capture_filter(sample, snaplen, user_program = None):
+    prefix = [
+        (0x20, 0, 0, (SKF_AD_OFF + SKF_AD_PKTTYPE) & 0xffffffff),  # ld pkttype
+        (0x15, None, 0, PACKET_OUTGOING),  # jeq outgoing => drop
+    ]
+    if sample > 1:
+        prefix += [
+            (0x20, 0, 0, (SKF_AD_OFF + SKF_AD_RANDOM) & 0xffffffff),  # ld random
+            (0x94, 0, 0, sample),  # mod sample
+            (0x15, 0, None, 0),  # jeq 0 => keep, else drop
+        ]
+    prefix.append((0x05, 0, 0, 1))  # ja over drop
+    drop = len(prefix)
+    prefix.append((0x06, 0, 0, 0))  # ret 0
+
+    # resolve jumps to drop (relative to the next instruction)
+    program = []
+    for (i, (code, jt, jf, k)) in enumerate(prefix):
+        program.append((code, drop - i - 1 if jt is None else jt, drop - i - 1 if jf is None else jf, k))
+
+    if user_program is None:
+        program.append((0x06, 0, 0, snaplen))
+    else:
+        # limit the accepted length of "ret #k"
+        program += [(code, jt, jf, min(k, snaplen) if code == 0x06 and k > 0 else k) for (code, jt, jf, k) in user_program]
+
+    return program
+
+def attach_filter(sock, program):
+    insns = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *insn) for insn in program))
+    fprog = struct.pack('HL', len(program), ctypes.addressof(insns))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+# protocol name of an Ethernet frame
+def classify_frame(data):
+    if len(data) < 14:
+        return 'short'
+    (ethertype,) = struct.unpack_from('!H', data, 12)
+    offset = 14
+    if ethertype == 0x8100 and len(data) >= 18:
+        (ethertype,) = struct.unpack_from('!H', data, 16)
+        offset = 18
+
+    if ethertype == 0x86dd and len(data) >= offset + 40:
+        proto = data[offset + 6]
+        offset += 40
+        # skip hop-by-hop options (e.g. MLD reports)
+        if proto == 0 and len(data) >= offset + 2:
+            proto = data[offset]
+            offset += 8 * (data[offset + 1] + 1)
+    elif ethertype == 0x0800 and len(data) >= offset + 20:
+        proto = data[offset + 9]
+        offset += 4 * (data[offset] & 0x0f)
+    else:
+        return ethertype_names.get(ethertype, 'ethertype 0x{:04x}'.format(ethertype))
+
+    if proto == 17 and len(data) >= offset + 4:
+        (sport, dport) = struct.unpack_from('!HH', data, offset)
+        name = udp_port_names.get(dport, udp_port_names.get(sport))
+        if name is not None:
+            return name
+    return '{} {}'.format(ethertype_names[ethertype], ip_proto_names.get(proto, 'proto {}'.format(proto)))
+
+'''
+Write pcap files (nanosecond timestamps) and start a new
+file after rotate_bytes, keeping at most rotate_count files.
+'''
+class PcapWriter:
+    def __init__(self, prefix, snaplen, rotate_bytes, rotate_count):
+        self.prefix = prefix
+        self.snaplen = snaplen
+        self.rotate_bytes = rotate_bytes
+        self.rotate_count = rotate_count
+        self.index = 0
+        self.file = None
+        self.open()
+
+    def open(self):
+        if self.file is not None:
+            self.file.close()
+        path = '{}-{:04}.pcap'.format(self.prefix, self.index)
+        old = '{}-{:04}.pcap'.format(self.prefix, self.index - self.rotate_count)
+        if self.index >= self.rotate_count and os.path.exists(old):
+            os.remove(old)
+        self.file = open(path, 'wb')
+        self.file.write(struct.pack('IHHiIII', 0xa1b23c4d, 2, 4, 0, 0, self.snaplen, 1))
+        self.index += 1
+
+    def write(self, sec, nsec, data, length):
+        if self.file.tell() + 16 + len(data) > self.rotate_bytes:
+            self.open()
+        self.file.write(struct.pack('IIII', sec, nsec, len(data), length))
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+'''
+Capture on all interfaces of namespace "switch" that match one of
+the patterns, using a single AF_PACKET socket with a TPACKET_V3 ring.
+Packets are mapped to interfaces by the ifindex of the ring entries.
+Executed in its own process, the result is sent over conn.
+'''
+def capture_worker(patterns, duration_ms, program, ring_bytes, pcap, conn):
+    setns(common.switch)
+
+    ifnames = {}
+    for (ifindex, ifname) in socket.if_nameindex():
+        if any(fnmatch.fnmatchcase(ifname, pattern) for pattern in patterns):
+            ifnames[ifindex] = ifname
+
+    block_size = 1 << 20
+    block_count = max(1, ring_bytes // block_size)
+    frame_size = 2048
+
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    attach_filter(sock, program)
+    sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+    # block size, block count, frame size, frame count, block timeout (ms), private size, features
+    sock.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack('7I',
+        block_size, block_count, frame_size, (block_size * block_count) // frame_size, 100, 0, 0))
+    # not bound to an interface => receives from all interfaces of the namespace
+    ring = mmap.mmap(sock.fileno(), block_size * block_count, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    writer = None
+    if pcap is not None:
+        writer = PcapWriter(*pcap)
+
+    # (protocol, ifname) => [packets, bytes]
+    counters = {}
+    poller = select.poll()
+    poller.register(sock, select.POLLIN | select.POLLERR)
+    deadline_ns = time.monotonic_ns() + duration_ms * 1000000
+    block = 0
+
+    while True:
+        remaining_ms = (deadline_ns - time.monotonic_ns()) // 1000000
+        if remaining_ms <= 0:
+            break
+
+        offset = block * block_size
+        (status, count, first) = struct.unpack_from('III', ring, offset + 8)
+        if not (status & TP_STATUS_USER):
+            poller.poll(min(remaining_ms, 100))
+            continue
+
+        pos = offset + first
+        for _ in range(0, count):
+            (next_offset, sec, nsec, snaplen, length, _, mac) = struct.unpack_from('IIIIIIH', ring, pos)
+            # struct sockaddr_ll follows the 48 bytes of struct tpacket3_hdr
+            (ifindex,) = struct.unpack_from('i', ring, pos + 52)
+            ifname = ifnames.get(ifindex)
+            if ifname is not None:
+                data = ring[pos + mac:pos + mac + snaplen]
+                key = (classify_frame(data), ifname)
+                counter = counters.get(key)
+                if counter is None:
+                    counter = counters[key] = [0, 0]
+                counter[0] += 1
+                counter[1] += length
+                if writer is not None:
+                    writer.write(sec, nsec, data, length)
+            pos += next_offset
+
+        # hand the block back to the kernel
+        struct.pack_into('I', ring, offset + 8, TP_STATUS_KERNEL)
+        block = (block + 1) % block_count
+
+    (packets, drops, _) = struct.unpack('III', sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+
+    if writer is not None:
+        writer.close()
+    ring.close()
+    sock.close()
+
+    conn.send((len(ifnames), counters, drops))
+
+def run_capture(patterns, duration_ms, sample, snaplen, bpf, ring_mb, pcap_prefix, rotate_mb, rotate_count, outfile = None):
+    program = get_capture_filter(sample, snaplen, None if bpf is None else parse_bpf(bpf))
+    pcap = None if pcap_prefix is None else (pcap_prefix, snaplen, rotate_mb * 1000000, rotate_count)
+
+    context = multiprocessing.get_context('fork')
+    (parent_conn, child_conn) = context.Pipe()
+    process = context.Process(target=capture_worker, args=(patterns, duration_ms, program, ring_mb * 1000000, pcap, child_conn))
+
+    with common.tracer.span('capture'):
+        process.start()
+        # the process exits without result on error
+        if parent_conn not in multiprocessing.connection.wait([parent_conn, process.sentinel]):
+            raise LabError('capture failed')
+        (interface_count, counters, drops) = parent_conn.recv()
+        process.join()
+
+    # per protocol over all interfaces
+    protocols = {}
+    for ((protocol, ifname), (packets, size)) in counters.items():
+        total = protocols.setdefault(protocol, [0, 0])
+        total[0] += packets
+        total[1] += size
+
+    if outfile is not None:
+        header = 'protocol interface packets bytes sample\n'
+        add_csv_header(outfile, header.replace(' ', common.csv_delimiter))
+        for ((protocol, ifname), (packets, size)) in sorted(counters.items()):
+            outfile.write(common.csv_delimiter.join([protocol, ifname, str(packets), str(size), str(sample)]) + '\n')
+
+    if common.verbosity != 'quiet':
+        print('captured on {} interfaces for {}ms, 1 in {} packets, {} dropped by the kernel'.format(
+            interface_count, duration_ms, sample, drops))
+        print('{:<24} {:>12} {:>14}'.format('protocol', 'packets', 'bytes'))
+        for (protocol, (packets, size)) in sorted(protocols.items(), key=lambda item: -item[1][1]):
+            # scale sampled counts up
+            print('{:<24} {:>12} {:>14}'.format(protocol, packets * sample, format_bytes(size * sample)))
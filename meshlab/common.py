@@ -0,0 +1,150 @@
+'''
+Settings and helpers shared by all modules of the lab.
+
+The command line tools set the settings from their arguments,
+library users can change them directly, e.g.:
+  from meshlab import common, tracing
+  common.verbosity = 'quiet'
+  common.tracer = tracing.Tracer('trace.json')
+  common.set_lab('a1')
+'''
+
+from . import tracing
+from . import names
+import sys
+import os
+import time
+
+
+# output of all modules: 'verbose', 'normal' or 'quiet'
+verbosity = 'normal'
+
+# delimiter of CSV output
+csv_delimiter = '\t'
+
+# timing spans, disabled by default
+tracer = tracing.Tracer()
+
+# lab instance (see set_lab), several labs can run side by side
+lab_name = None
+switch = 'switch'
+ns_prefix = 'ns-'
+
+# original node names of the namespaces
+name_map = names.NameMap('/tmp/meshnet-names.json')
+
+# options for new interfaces and links
+ignore_tc = False
+# 'bridge' (bridge per node, veth pair per link) or 'mirred' (tc mirror actions between uplinks)
+data_plane = 'bridge'
+block_arp = False
+block_multicast = False
+
+'''
+Fatal error of a lab operation. The command line tools print
+the message and exit, the controller returns it to the client.
+'''
+class LabError(Exception):
+    pass
+
+def eprint(s):
+    sys.stderr.write(s + '\n')
+
+# monotonic time in milliseconds, for time spans only
+def millis():
+    return time.monotonic_ns() // 1000000
+
+'''
+Select the lab instance. The namespaces of lab "a1" are "a1-switch" and
+"a1-ns-<node>", its state files are "/tmp/meshnet-a1-*". Interfaces
+are not renamed, their names only need to be unique per namespace.
+Without a name, the namespaces are "switch" and "ns-<node>".
+'''
+def set_lab(name):
+    global lab_name, switch, ns_prefix, name_map
+    lab_name = name
+    prefix = '' if name is None else name + '-'
+    switch = prefix + 'switch'
+    ns_prefix = prefix + 'ns-'
+    name_map = names.NameMap(get_state_path('names.json'))
+
+# valid lab names, part of namespace and file names
+def is_lab_name(name):
+    # "ns-ns-<node>" would be a node of the default lab
+    return len(name) > 0 and len(name) <= 16 and name != 'ns' and all(c.isalnum() or c == '_' for c in name)
+
+# state file of the lab, e.g. "/tmp/meshnet-a1-network.journal"
+def get_state_path(name):
+    if lab_name is None:
+        return '/tmp/meshnet-{}'.format(name)
+    return '/tmp/meshnet-{}-{}'.format(lab_name, name)
+
+# namespace of a node (by short id)
+def get_nsname(node):
+    return ns_prefix + node
+
+# short id of a node namespace
+def get_node_id(nsname):
+    return nsname[len(ns_prefix):]
+
+# namespace name with the original node name, for output
+def get_display_name(nsname):
+    if not nsname.startswith(ns_prefix):
+        return nsname
+    return 'ns-' + name_map.get_name(get_node_id(nsname))
+
+'''
+Add a CSV header if the target file is empty or
+extend existing header (for added data outside of this script)
+'''
+def add_csv_header(file, header):
+    pos = file.tell()
+
+    if pos == 0:
+        # empty file => add header
+        file.write(header)
+
+    if pos > 0 and pos < len(header):
+        # non-empty files but cannot be our header => assume existing header and extend it
+        file.seek(0)
+        content = file.read()
+        if content.count('\n') == 1:
+            file.seek(0)
+            file.truncate()
+            lines = content.split('\n')
+            file.write(lines[0] + csv_delimiter + header)
+            file.write(lines[1])
+
+def format_bytes(size):
+    power = 1000
+    n = 0
+    power_labels = {0 : '', 1: 'K', 2: 'M', 3: 'G', 4: 'T', 5: 'E'}
+    while size > power:
+        size /= power
+        n += 1
+    return '{:.2f} {}B'.format(size, power_labels[n])
+
+# all node namespaces of the lab, same as "ip netns list" without starting a process
+def get_nsnames():
+    if not os.path.isdir('/var/run/netns'):
+        return []
+    return [x for x in os.listdir('/var/run/netns') if x.startswith(ns_prefix)]
+
+'''
+Restrict this process and all processes it starts (commands, daemons,
+workers) to a set of CPUs like "0-7,16", like taskset. Labs that run
+side by side get disjoint sets.
+'''
+def set_cpus(spec):
+    cpus = set()
+    try:
+        for part in spec.split(','):
+            (first, _, last) = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+        os.sched_setaffinity(0, cpus)
+    except (ValueError, OSError) as e:
+        raise LabError('invalid CPU list {}: {}'.format(spec, e))
+
+# number of CPUs this process may run on
+def get_cpu_count():
+    return len(os.sched_getaffinity(0))
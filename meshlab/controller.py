@@ -0,0 +1,322 @@
+'''
+Long-running controller that owns the lab state (topology, namespace
+list, running protocol, address cache and namespace workers) and
+accepts commands over a Unix socket, so a script does not pay process
+startup and rediscovery for every step.
+
+Requests and replies are JSON objects, one per line:
+  {"id": 1, "method": "delta", "params": {"links": [{"source": "a", "target": "b"}]}}
+  {"id": 1, "result": {"nodes": 2, "links": 1, "duration_ms": 41.2}}
+  {"id": 2, "error": "unknown method: foo"}
+'''
+
+import selectors
+import socket
+import json
+import time
+import os
+
+from .lab import Topology, CommandError
+from .protocols import Protocol
+from .probes import Probe
+from .reachability import run_reachability
+from .namespaces import get_workers, read_interface_statistics, read_link_statistics
+from .common import LabError
+from . import common
+
+
+# socket of the default lab, see common.get_state_path
+default_socket_path = '/tmp/meshnet-controller.sock'
+
+class RequestError(Exception):
+    pass
+
+# key of a link in both directions
+def get_link_key(source, target):
+    return tuple(sorted((str(source), str(target))))
+
+class Controller:
+    def __init__(self, lab, topology):
+        self.lab = lab
+        self.topology = topology
+        self.nsnames = lab.get_nsnames()
+        self.protocol = None
+        # interface => (nsname => address)
+        self.addresses = {}
+        self.started = time.monotonic()
+        self.running = True
+
+        self.methods = {
+            'status': self.status,
+            'change': self.change,
+            'delta': self.delta,
+            'set_tc': self.set_tc,
+            'start': self.start,
+            'stop': self.stop,
+            'probe': self.probe,
+            'traffic': self.traffic,
+            'reachability': self.reachability,
+            'counters': self.counters,
+            'shutdown': self.shutdown
+        }
+
+    def status(self):
+        return {
+            'nodes': len(self.nsnames),
+            'links': len(self.topology.json_data['links']),
+            'protocol': None if self.protocol is None else self.protocol.name,
+            'uptime_s': round(time.monotonic() - self.started, 3)
+        }
+
+    # apply a whole new topology (JSON object like in the topology files)
+    def change(self, topology):
+        return self.apply(Topology(topology))
+
+    '''
+    Add, replace or remove links of the current topology:
+    {"links": [{"source": "a", "target": "c", "source_tc": "..."}], "remove": [["a", "b"]]}
+    '''
+    def delta(self, links = None, remove = None):
+        index = {}
+        for link in self.topology.json_data['links']:
+            index[get_link_key(link['source'], link['target'])] = link
+        for link in links or []:
+            if not isinstance(link, dict) or 'source' not in link or 'target' not in link:
+                raise RequestError('invalid link: {}'.format(json.dumps(link)))
+            index[get_link_key(link['source'], link['target'])] = link
+        for (source, target) in remove or []:
+            if index.pop(get_link_key(source, target), None) is None:
+                raise RequestError('unknown link: {} <-> {}'.format(source, target))
+
+        json_data = dict(self.topology.json_data)
+        json_data['links'] = list(index.values())
+        return self.apply(Topology(json_data))
+
+    # change the traffic control settings of one link, omitted settings are removed
+    def set_tc(self, source, target, source_tc = None, target_tc = None, source_police = None, target_police = None):
+        link = {'source': source, 'target': target}
+        for (key, value) in (('source_tc', source_tc), ('target_tc', target_tc), ('source_police', source_police), ('target_police', target_police)):
+            if value is not None:
+                link[key] = value
+        for old in self.topology.json_data['links']:
+            if get_link_key(old['source'], old['target']) == get_link_key(source, target):
+                return self.delta(links=[link])
+        raise RequestError('unknown link: {} <-> {}'.format(source, target))
+
+    def apply(self, topology):
+        (problems, warnings, info) = topology.validate()
+        if len(problems) > 0:
+            raise RequestError('invalid topology: {}'.format('; '.join(problems)))
+
+        start_ns = time.monotonic_ns()
+        task = self.topology.diff(topology, self.lab.name_map)
+        try:
+            self.lab.apply(task)
+        except CommandError as e:
+            # rolled back, the old topology is still in place
+            raise RequestError('command failed: {}'.format(e))
+
+        self.topology = topology
+        self.nsnames = self.lab.get_nsnames()
+        # forget the addresses of removed nodes
+        for addresses in self.addresses.values():
+            for node in task.nodes_remove:
+                addresses.pop(common.get_nsname(node.name), None)
+
+        return {
+            'nodes_created': len(task.nodes_create),
+            'nodes_removed': len(task.nodes_remove),
+            'links_created': len(task.links_create),
+            'links_updated': len(task.links_update),
+            'links_removed': len(task.links_remove),
+            'duration_ms': (time.monotonic_ns() - start_ns) / 1000000.0
+        }
+
+    def start(self, protocol):
+        if self.protocol is not None:
+            self.protocol = self.protocol.switch(protocol, self.nsnames)
+        else:
+            self.protocol = Protocol(protocol)
+            self.protocol.start(self.nsnames)
+        # addresses are set up by the protocol
+        self.addresses = {}
+        return self.status()
+
+    def stop(self):
+        if self.protocol is not None:
+            self.protocol.stop(self.nsnames)
+            self.protocol = None
+        self.addresses = {}
+        return self.status()
+
+    def get_probe(self):
+        interface = 'uplink' if self.protocol is None else self.protocol.interface
+        return Probe(self.nsnames, interface, None, self.addresses.setdefault(interface, {}))
+
+    # ping random pairs, see Probe.run
+    def probe(self, samples = 10, duration_ms = 1000, wait_ms = 0, arrival = 'even'):
+        return self.get_probe().run(samples, duration_ms, wait_ms, None, arrival)
+
+    # traffic flows between random pairs, see Probe.traffic
+    def traffic(self, transport = 'udp', pattern = 'uniform', flows = 10, rate = 100, size = 1000, duration_ms = 10000):
+        result = []
+        for flow in self.get_probe().traffic(transport, pattern, flows, rate, size, duration_ms):
+            result.append({
+                'source': common.name_map.get_name(common.get_node_id(flow.source)),
+                'target': common.name_map.get_name(common.get_node_id(flow.target)),
+                'packets_send': flow.packets_send,
+                'packets_received': flow.packets_received,
+                'latency_avg_ms': 0.0 if flow.packets_received == 0 else (flow.latency_sum_ns / flow.packets_received / 1000000.0),
+                'latency_max_ms': flow.latency_max_ns / 1000000.0
+            })
+        return result
+
+    # node names => namespace names, all nodes if None
+    def get_nsnames(self, nodes):
+        if nodes is None:
+            return self.nsnames
+        known = set(self.nsnames)
+        nsnames = []
+        for node in nodes:
+            id = self.lab.name_map.find_id(str(node))
+            if id is None or common.get_nsname(id) not in known:
+                raise RequestError('unknown node: {}'.format(node))
+            nsnames.append(common.get_nsname(id))
+        return nsnames
+
+    # echo requests between all sources and targets, see run_reachability
+    def reachability(self, sources = None, targets = None, rate = 2000, count = 1, timeout_ms = 1000):
+        sources = self.get_nsnames(sources)
+        targets = self.get_nsnames(targets)
+        probe = self.get_probe()
+        (reachable, pairs, rtts) = run_reachability(sources, targets, probe.interface, rate, count, timeout_ms,
+            address_cache=probe.address_cache)
+        return {
+            'pairs': pairs,
+            'reachable': reachable,
+            'unreachable': [[common.name_map.get_name(common.get_node_id(sources[i])), common.name_map.get_name(common.get_node_id(targets[j]))]
+                for i in range(0, len(sources)) for j in range(0, len(targets))
+                if sources[i] != targets[j] and j not in rtts[i]]
+        }
+
+    '''
+    Counters of the uplinks (node => [rx_bytes, rx_packets, tx_bytes, tx_packets])
+    and of the link directions ("source-target" => [tx_bytes, tx_packets]).
+    '''
+    def counters(self, nodes = None):
+        nsnames = self.get_nsnames(nodes)
+
+        uplinks = {}
+        for (nsname, stats) in zip(nsnames, get_workers().map(read_interface_statistics, nsnames, 'uplink')):
+            uplinks[common.name_map.get_name(common.get_node_id(nsname))] = stats
+
+        links = {}
+        for (ifname, stats) in get_workers().call(common.switch, read_link_statistics).items():
+            (source, target) = ifname[3:].split('-', 1)
+            links['{}-{}'.format(common.name_map.get_name(source), common.name_map.get_name(target))] = stats
+
+        return {'uplinks': uplinks, 'links': links}
+
+    def shutdown(self):
+        self.running = False
+        return {}
+
+    # execute a request object, returns the reply object
+    def handle(self, request):
+        reply = {'id': request.get('id') if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict) or request.get('method') not in self.methods:
+                raise RequestError('unknown method: {}'.format(request.get('method') if isinstance(request, dict) else request))
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise RequestError('params must be an object')
+            with common.tracer.span('rpc ' + request['method']):
+                reply['result'] = self.methods[request['method']](**params)
+        except (RequestError, LabError, CommandError) as e:
+            reply['error'] = str(e)
+        except Exception as e:
+            # a failed request must not stop the controller
+            reply['error'] = '{}: {}'.format(type(e).__name__, e)
+        return reply
+
+    '''
+    Serve requests until "shutdown". Requests are executed one at a
+    time in the order they are read, from any number of clients.
+    '''
+    def serve(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen(16)
+
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ, None)
+
+        try:
+            while self.running:
+                for (key, _) in selector.select():
+                    if key.data is None:
+                        (conn, _) = server.accept()
+                        selector.register(conn, selectors.EVENT_READ, bytearray())
+                        continue
+
+                    conn = key.fileobj
+                    buffer = key.data
+                    try:
+                        data = conn.recv(65536)
+                    except OSError:
+                        data = b''
+                    if len(data) == 0:
+                        selector.unregister(conn)
+                        conn.close()
+                        continue
+
+                    buffer.extend(data)
+                    while b'\n' in buffer:
+                        (line, _, rest) = bytes(buffer).partition(b'\n')
+                        buffer[:] = rest
+                        try:
+                            request = json.loads(line)
+                        except ValueError as e:
+                            reply = {'id': None, 'error': 'invalid JSON: {}'.format(e)}
+                        else:
+                            reply = self.handle(request)
+                        try:
+                            conn.sendall(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+                        except OSError:
+                            # client is gone, drop only this connection
+                            selector.unregister(conn)
+                            conn.close()
+                            break
+        finally:
+            selector.close()
+            server.close()
+            os.remove(path)
+
+'''
+Client for the controller, e.g.:
+  client = ControllerClient()
+  client.call('delta', remove=[['a', 'b']])
+'''
+class ControllerClient:
+    def __init__(self, path = default_socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+        self.next_id = 1
+
+    # returns the result or raises RequestError
+    def call(self, method, **params):
+        request = {'id': self.next_id, 'method': method, 'params': params}
+        self.next_id += 1
+        self.sock.sendall(json.dumps(request, separators=(',', ':')).encode() + b'\n')
+        reply = json.loads(self.file.readline())
+        if 'error' in reply:
+            raise RequestError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
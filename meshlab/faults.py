@@ -0,0 +1,272 @@
+'''
+Fault injection: link flaps, node failures and partitions while
+probe flows measure the time to recover.
+'''
+
+import random
+import json
+import math
+import time
+
+from .common import LabError, get_display_name, add_csv_header
+from .namespaces import get_workers, read_link_statistics, set_interfaces_up
+from .lab import get_data_plane
+from .probes import Flow, ProbeScheduler, flow_header, get_flow_pairs, resolve_flow_addresses, start_flow_processes, wait_flow_processes
+from . import common
+
+
+'''
+A failure that is applied at a time (relative to the start of
+probing) and repaired after a duration by setting interfaces down
+and up again. Flows between the side and the rest of the network
+cannot recover while the fault is active and are not measured.
+'''
+class Fault:
+    def __init__(self, kind, target, ifnames, side, at_ms, down_ms):
+        self.kind = kind
+        self.target = target
+        self.ifnames = ifnames
+        self.side = side
+        self.at_ms = at_ms
+        self.down_ms = down_ms
+
+    def blocks(self, flow):
+        return (flow.source in self.side) != (flow.target in self.side)
+
+# links as sorted (nsname, nsname) pairs, from the veth names "ve-<a>-<b>" in namespace "switch"
+def get_links():
+    links = set()
+    for ifname in get_workers().call(common.switch, read_link_statistics):
+        (_, a, b) = ifname.split('-')
+        links.add(tuple(sorted((common.get_nsname(a), common.get_nsname(b)))))
+    return sorted(links)
+
+def get_link_fault(a, b, at_ms, down_ms):
+    target = '{}-{}'.format(get_display_name(a)[3:], get_display_name(b)[3:])
+    (a_id, b_id) = (common.get_node_id(a), common.get_node_id(b))
+    ifnames = ['ve-{}-{}'.format(a_id, b_id), 've-{}-{}'.format(b_id, a_id)]
+    return Fault('link', target, ifnames, set(), at_ms, down_ms)
+
+# the uplink of the node is down, like a crashed device
+def get_node_fault(nsname, at_ms, down_ms):
+    return Fault('node', get_display_name(nsname)[3:], ['dl-{}'.format(common.get_node_id(nsname))], {nsname}, at_ms, down_ms)
+
+# all links between side and the rest of the network are down
+def get_partition_fault(side, links, at_ms, down_ms):
+    ifnames = []
+    for (a, b) in links:
+        if (a in side) != (b in side):
+            (a_id, b_id) = (common.get_node_id(a), common.get_node_id(b))
+            ifnames.extend(['ve-{}-{}'.format(a_id, b_id), 've-{}-{}'.format(b_id, a_id)])
+    target = '{} nodes'.format(len(side))
+    return Fault('partition', target, ifnames, set(side), at_ms, down_ms)
+
+# connected half of the network, grown from a random node in random order
+def get_random_side(nsnames, links):
+    neighbors = {}
+    for (a, b) in links:
+        neighbors.setdefault(a, []).append(b)
+        neighbors.setdefault(b, []).append(a)
+
+    start = random.choice(nsnames)
+    side = {start}
+    frontier = [start]
+    while len(frontier) > 0 and len(side) < len(nsnames) // 2:
+        nsname = frontier.pop(random.randrange(len(frontier)))
+        for neighbor in neighbors.get(nsname, []):
+            if neighbor not in side and len(side) < len(nsnames) // 2:
+                side.add(neighbor)
+                frontier.append(neighbor)
+    return side
+
+def get_random_faults(nsnames, links, kinds, count, interval_ms, down_ms, warmup_ms):
+    faults = []
+    for i in range(0, count):
+        kind = random.choice(kinds)
+        at_ms = warmup_ms + i * interval_ms
+        if kind == 'link':
+            (a, b) = random.choice(links)
+            faults.append(get_link_fault(a, b, at_ms, down_ms))
+        elif kind == 'node':
+            faults.append(get_node_fault(random.choice(nsnames), at_ms, down_ms))
+        else:
+            faults.append(get_partition_fault(get_random_side(nsnames, links), links, at_ms, down_ms))
+    return faults
+
+'''
+Read faults from a JSON file, times in seconds from the start of probing:
+[
+  {"at": 5, "down": 3, "type": "link", "nodes": ["a", "b"]},
+  {"at": 15, "down": 3, "type": "node", "nodes": ["c"]},
+  {"at": 25, "down": 5, "type": "partition", "nodes": ["a", "c", "d"]}
+]
+'''
+def read_faults(path, nsnames, links):
+    with open(path) as file:
+        entries = json.load(file)
+
+    known = set(nsnames)
+    faults = []
+    for entry in entries:
+        kind = entry.get('type')
+        ids = [common.name_map.find_id(str(name)) for name in entry.get('nodes', [])]
+        side = [common.get_nsname(id) for id in ids if id is not None]
+        at_ms = 1000.0 * entry.get('at', 0)
+        down_ms = 1000.0 * entry.get('down', 0)
+        unknown = [nsname for nsname in side if nsname not in known]
+        if len(unknown) > 0 or len(side) < len(ids) or len(side) == 0:
+            raise LabError('unknown or no nodes in fault: {}'.format(json.dumps(entry)))
+
+        if kind in ('link', 'partition') and links is None:
+            raise LabError('{} faults need the bridge data plane: {}'.format(kind, json.dumps(entry)))
+        elif kind == 'link' and len(side) == 2 and tuple(sorted(side)) in links:
+            faults.append(get_link_fault(side[0], side[1], at_ms, down_ms))
+        elif kind == 'node' and len(side) == 1:
+            faults.append(get_node_fault(side[0], at_ms, down_ms))
+        elif kind == 'partition':
+            faults.append(get_partition_fault(set(side), links, at_ms, down_ms))
+        else:
+            raise LabError('invalid fault: {}'.format(json.dumps(entry)))
+
+    return sorted(faults, key=lambda fault: fault.at_ms)
+
+'''
+Measure the packet loss of the flows that were sent in [beg_ns, end_ns).
+A flow is affected if it lost packets, it has recovered when the
+first packet after the last loss was sent. Returns (affected flows,
+lost packets, recovery time in ns, all affected flows recovered).
+'''
+def get_recovery(flows, interval_ns, beg_ns, end_ns):
+    affected = 0
+    lost = 0
+    recovery_ns = 0
+    recovered = True
+
+    for flow in flows:
+        # packet seq is sent at start_ns + (seq - 1) * interval_ns
+        first = max(1, -((flow.start_ns - beg_ns) // interval_ns) + 1)
+        last = min(flow.packets_send, len(flow.received) - 1, -((flow.start_ns - end_ns) // interval_ns))
+        lost_seqs = [seq for seq in range(first, last + 1) if not flow.received[seq]]
+        if len(lost_seqs) == 0:
+            continue
+
+        affected += 1
+        lost += len(lost_seqs)
+        if lost_seqs[-1] == last:
+            recovered = False
+        # send time of the packet after the last lost one
+        recovery_ns = max(recovery_ns, flow.start_ns + lost_seqs[-1] * interval_ns - beg_ns)
+
+    return (affected, lost, recovery_ns, recovered)
+
+def run_faults(nsnames, interface, faults_path, kinds, count, interval_ms, down_ms, warmup_ms, settle_ms, flow_count, rate, outfile = None):
+    # the mirred data plane has no veth per link, only nodes can fail
+    links = None
+    if get_data_plane() == 'mirred':
+        if faults_path is None and ('link' in kinds or 'partition' in kinds):
+            raise LabError('link and partition faults need the bridge data plane')
+    else:
+        links = get_links()
+        if len(links) == 0:
+            raise LabError('no links found in namespace "{}"'.format(common.switch))
+
+    if faults_path is not None:
+        faults = read_faults(faults_path, nsnames, links)
+    else:
+        faults = get_random_faults(nsnames, links, kinds, count, interval_ms, down_ms, warmup_ms)
+
+    # (intended offset, up, fault), repairs before failures at the same time
+    events = []
+    for fault in faults:
+        events.append((int(fault.at_ms * 1000000), False, fault))
+        events.append((int((fault.at_ms + fault.down_ms) * 1000000), True, fault))
+    events.sort(key=lambda event: (event[0], not event[1]))
+    duration_ms = int(max([0] + [event[0] // 1000000 for event in events]) + settle_ms)
+
+    pairs = get_flow_pairs(nsnames, flow_count, 'uniform')
+    flows = [Flow(i, source, target, 5000 + i) for (i, (source, target)) in enumerate(pairs)]
+    resolve_flow_addresses(flows, interface)
+    interval_ns = int(1000000000 / rate)
+    for flow in flows:
+        flow.received = bytearray(int(duration_ms * rate / 1000) + 2)
+
+    if common.verbosity != 'quiet':
+        print('{} faults on {} links, {} probe flows with {} packets/s, duration: {}ms'.format(
+            len(faults), len(links or []), len(flows), rate, duration_ms))
+
+    # interfaces can be part of multiple active faults
+    down_counts = {}
+    applied_ns = []
+
+    def apply_event(i):
+        (_, up, fault) = events[i]
+        changed = []
+        for ifname in fault.ifnames:
+            count = down_counts.get(ifname, 0) + (-1 if up else 1)
+            down_counts[ifname] = count
+            if count == (0 if up else 1):
+                changed.append(ifname)
+        applied_ns.append(get_workers().call(common.switch, set_interfaces_up, changed, up))
+
+    processes = start_flow_processes(flows, 'udp', interface, rate, flow_header.size, duration_ms)
+    scheduler = ProbeScheduler(len(events), 0, offsets_ns=[event[0] for event in events])
+    try:
+        with common.tracer.span('faults', faults=len(faults)):
+            scheduler.run(apply_event)
+    finally:
+        # never leave interfaces down
+        get_workers().call(common.switch, set_interfaces_up, [ifname for (ifname, count) in down_counts.items() if count > 0], True)
+
+    with common.tracer.span('flows', flows=len(flows)):
+        flows = wait_flow_processes(processes)
+
+    # flows that did not work before the first fault cannot recover, check the packet sent one interval before
+    first_ns = applied_ns[0] if len(applied_ns) > 0 else time.monotonic_ns()
+    def is_working(flow):
+        seq = (first_ns - interval_ns - flow.start_ns) // interval_ns + 1
+        return 1 <= seq < len(flow.received) and flow.received[seq] == 1
+    working = [flow for flow in flows if is_working(flow)]
+    if common.verbosity != 'quiet':
+        print('schedule lateness avg: {:0.3f}ms, p99: {:0.3f}ms, max: {:0.3f}ms, {} of {} flows working before the first fault'.format(
+            *scheduler.get_lateness_ms(), len(working), len(flows)))
+
+    if outfile is not None:
+        header = 'time_ms event type target affected_flows lost_packets recovery_ms recovered\n'
+        add_csv_header(outfile, header.replace(' ', common.csv_delimiter))
+
+    if common.verbosity != 'quiet':
+        print('{:>9} {:<5} {:<10} {:<24} {:>8} {:>8} {:>12}'.format('time ms', 'event', 'type', 'target', 'affected', 'lost', 'recovery ms'))
+
+    active = []
+    recovery_ms = []
+    for (i, (_, up, fault)) in enumerate(events):
+        if up:
+            active.remove(fault)
+        else:
+            active.append(fault)
+        beg_ns = applied_ns[i]
+        end_ns = applied_ns[i + 1] if (i + 1) < len(applied_ns) else (scheduler.start_ns + duration_ms * 1000000)
+        measured = [flow for flow in working if not any(f.blocks(flow) for f in active)]
+        (affected, lost, ns, recovered) = get_recovery(measured, interval_ns, beg_ns, end_ns)
+        time_ms = (beg_ns - scheduler.start_ns) / 1000000.0
+        event = 'up' if up else 'down'
+        if recovered:
+            recovery_ms.append(ns / 1000000.0)
+
+        if outfile is not None:
+            outfile.write('{:0.3f} {} {} {} {} {} {:0.3f} {}\n'.format(
+                time_ms, event, fault.kind, fault.target.replace(' ', '_'), affected, lost, ns / 1000000.0, int(recovered)
+            ).replace(' ', common.csv_delimiter))
+
+        if common.verbosity != 'quiet':
+            print('{:>9.1f} {:<5} {:<10} {:<24} {:>8} {:>8} {:>12}'.format(
+                time_ms, event, fault.kind, fault.target[:24], '{}/{}'.format(affected, len(measured)), lost,
+                '{:0.1f}'.format(ns / 1000000.0) if recovered else 'not recovered'))
+
+    if common.verbosity != 'quiet' and len(recovery_ms) > 0:
+        recovery_ms.sort()
+        print('time to recover avg: {:0.1f}ms, p90: {:0.1f}ms, max: {:0.1f}ms, {} of {} events not recovered'.format(
+            math.fsum(recovery_ms) / len(recovery_ms),
+            recovery_ms[min(len(recovery_ms) - 1, int(len(recovery_ms) * 0.9))],
+            recovery_ms[-1],
+            len(events) - len(recovery_ms), len(events)))
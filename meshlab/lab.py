@@ -0,0 +1,981 @@
+'''
+Build and change the virtual network: one namespace per node,
+connected by veth pairs and bridges in namespace "switch".
+With the "mirred" data plane, there are no bridges and link veths,
+frames are copied between the downlinks by tc mirror actions.
+'''
+
+import concurrent.futures
+import subprocess
+import signal
+import select
+import time
+import json
+import os
+
+from . import names
+from . import common
+
+
+class CommandError(Exception):
+    pass
+
+def exec(cmd):
+    with common.tracer.command(cmd):
+        rc = os.system(cmd)
+    if rc != 0:
+        raise CommandError(cmd)
+
+def configure_interface(nsname, ifname):
+    # up interface
+    exec('ip netns exec "{}" ip link set dev "{}" up'.format(nsname, ifname))
+
+    # disable arp / multicast
+    # we do not want the OS to send packets on its own,
+    # but many mesh protocols need arp/multicast on each link to work
+    if common.block_arp:
+        exec('ip netns exec "{}" ip link set dev "{}" arp off'.format(nsname, ifname))
+
+    if common.block_multicast:
+        exec('ip netns exec "{}" ip link set dev "{}" multicast off'.format(nsname, ifname))
+
+def remove_node(node):
+    name = node.name
+    if common.verbosity == 'verbose':
+        print('  remove node {}'.format(name))
+
+    nsname = common.get_nsname(name)
+    brname = 'br-{}'.format(name)
+    downname = 'dl-{}'.format(name)
+
+    # remove veth pair upname/downname (removes both)
+    exec('ip netns exec "{}" ip link delete "{}"'.format(common.switch, downname))
+
+    if common.data_plane == 'bridge':
+        # remove bridge (assume that it does not have an interfaces anymore)
+        exec('ip netns exec "{}" ip link delete "{}" type bridge'.format(common.switch, brname))
+
+    # remove network namespace
+    exec('ip netns del "{}"'.format(nsname))
+
+def create_node(node):
+    name = node.name
+    if common.verbosity == 'verbose':
+        print('  create node {}'.format(name))
+
+    nsname = common.get_nsname(name)
+    brname = 'br-{}'.format(name)
+    upname = 'uplink'
+    downname = 'dl-{}'.format(name)
+
+    exec('ip netns add "{}"'.format(nsname))
+
+    # up localhost
+    exec('ip netns exec "{}" ip link set dev "lo" up'.format(nsname))
+
+    if common.data_plane == 'mirred':
+        exec('ip netns exec "{}" ip link add name "{}" type veth peer name "{}" netns "{}"'.format(common.switch, downname, upname, nsname))
+        # filters with the mirror actions to the neighbours are set by apply_task
+        exec('ip netns exec "{}" tc qdisc add dev "{}" clsact'.format(common.switch, downname))
+        configure_interface(common.switch, downname)
+        configure_interface(nsname, upname)
+        return
+
+    # create bridge
+    exec('ip netns exec "{}" ip link add name "{}" type bridge'.format(common.switch, brname))
+    configure_interface(common.switch, brname)
+
+    # Disable STP (should be off by default anyway)
+    exec('ip netns exec "{}" ip link set "{}" type bridge stp_state 0'.format(common.switch, brname))
+
+    # Make the bridge to act as a hub
+    exec('ip netns exec "{}" ip link set "{}" type bridge ageing_time 0'.format(common.switch, brname))
+    exec('ip netns exec "{}" ip link set "{}" type bridge forward_delay 0'.format(common.switch, brname))
+
+    # create interface pair in switch namespace
+    exec('ip netns exec "{}" ip link add name "{}" type veth peer name "{}"'.format(common.switch, upname, downname))
+
+    # move uplink from namespace 'switch' into the nodes namespace
+    exec('ip netns exec "{}" ip link set "{}" netns "{}"'.format(common.switch, upname, nsname))
+
+    # put uplinkport into bridge
+    exec('ip netns exec "{}" ip link set "{}" master "{}"'.format(common.switch, downname, brname))
+
+    configure_interface(common.switch, downname)
+    configure_interface(nsname, upname)
+
+def remove_link(link):
+    if common.verbosity == 'verbose':
+        print('  remove link {} <-> {}'.format(link.source, link.target))
+
+    ifname1 = 've-{}-{}'.format(link.source, link.target)
+    ifname2 = 've-{}-{}'.format(link.target, link.source)
+    exec('ip netns exec "{}" ip link del "{}" type veth peer name "{}"'.format(common.switch, ifname1, ifname2))
+
+def update_link(link, old, tc):
+    if common.verbosity == 'verbose':
+        print('  update link {} <-> {}'.format(link.source, link.target))
+
+    ifname1 = 've-{}-{}'.format(link.source, link.target)
+    ifname2 = 've-{}-{}'.format(link.target, link.source)
+
+    if not common.ignore_tc:
+        # source -> target
+        tc.update(ifname1, ifname2, link.source_tc, old.source_tc, link.source_police, old.source_police)
+        # target -> source
+        tc.update(ifname2, ifname1, link.target_tc, old.target_tc, link.target_police, old.target_police)
+
+def create_link(link, tc):
+    if common.verbosity == 'verbose':
+        print('  create link {} <-> {}'.format(link.source, link.target))
+
+    ifname1 = 've-{}-{}'.format(link.source, link.target)
+    ifname2 = 've-{}-{}'.format(link.target, link.source)
+
+    br1name = 'br-{}'.format(link.source)
+    br2name = 'br-{}'.format(link.target)
+
+    # create pair of interfaces
+    exec('ip netns exec "{}" ip link add "{}" type veth peer name "{}"'.format(common.switch, ifname1, ifname2))
+
+    configure_interface(common.switch, ifname1)
+    configure_interface(common.switch, ifname2)
+
+    # put into bridge
+    exec('ip netns exec "{}" ip link set "{}" master "{}"'.format(common.switch, ifname2, br2name))
+    exec('ip netns exec "{}" ip link set "{}" master "{}"'.format(common.switch, ifname1, br1name))
+
+    # isolate interfaces (they can only speak to the downlink interface in the bridge they are)
+    exec('ip netns exec "{}" bridge link set dev "{}" isolated on'.format(common.switch, ifname1))
+    exec('ip netns exec "{}" bridge link set dev "{}" isolated on'.format(common.switch, ifname2))
+
+    if not common.ignore_tc:
+        # source -> target
+        tc.update(ifname1, ifname2, link.source_tc, None, link.source_police, None)
+        # target -> source
+        tc.update(ifname2, ifname1, link.target_tc, None, link.target_police, None)
+
+# actions per tc filter (TCA_ACT_MAX_PRIO)
+max_filter_actions = 32
+
+'''
+Get the tc commands that make a downlink act like a hub port with the
+mirred data plane: frames from the uplink are mirrored to the downlinks
+of all neighbours and leave through their uplinks, but are never passed
+on from there. Filters are chained for more than 32 neighbours, the last
+neighbour gets the frame itself. Without neighbours, the frame ends in
+namespace "switch" (IPv6 is disabled there).
+'''
+def get_mirror_lines(downname, targets):
+    lines = ['filter del dev "{}" ingress'.format(downname)]
+    for i in range(0, len(targets), max_filter_actions):
+        chunk = targets[i:i + max_filter_actions]
+        actions = []
+        for (j, target) in enumerate(chunk):
+            if i + j == len(targets) - 1:
+                actions.append('action mirred egress redirect dev "{}"'.format(target))
+            elif j == len(chunk) - 1:
+                # go on with the filter of the next chunk
+                actions.append('action mirred egress mirror dev "{}" continue'.format(target))
+            else:
+                actions.append('action mirred egress mirror dev "{}"'.format(target))
+        lines.append('filter add dev "{}" ingress pref {} u32 match u32 0 0 {}'.format(
+            downname, i // max_filter_actions + 1, ' '.join(actions)))
+    return lines
+
+'''
+Collect the traffic control settings of all links and apply them at once.
+Identical specifications are only validated once, on the first interface
+they are used for. All other interfaces are set by a single "tc -batch".
+'''
+class TrafficControl:
+    def __init__(self):
+        # specification => list of interfaces
+        self.qdiscs = {}
+        self.police = {}
+        self.removals = []
+
+    '''
+    Traffic of one direction leaves through ifname_out (egress qdisc)
+    and enters the bridge of the other node through ifname_in (ingress police).
+    '''
+    def update(self, ifname_out, ifname_in, qdisc, old_qdisc, police, old_police):
+        if qdisc is not None:
+            self.qdiscs.setdefault(qdisc, []).append(ifname_out)
+        elif old_qdisc is not None:
+            self.removals.append('qdisc del dev "{}" root'.format(ifname_out))
+
+        if police is not None:
+            self.police.setdefault(police, []).append(ifname_in)
+        elif old_police is not None:
+            # removes the filter as well
+            self.removals.append('qdisc del dev "{}" ingress'.format(ifname_in))
+
+    def apply(self):
+        lines = list(self.removals)
+
+        for (spec, ifnames) in self.qdiscs.items():
+            exec('ip netns exec "{}" tc qdisc replace dev "{}" root {}'.format(common.switch, ifnames[0], spec))
+            for ifname in ifnames[1:]:
+                lines.append('qdisc replace dev "{}" root {}'.format(ifname, spec))
+
+        # a shared filter block would also share the token bucket
+        # of the police action, so every port gets its own filter
+        for (spec, ifnames) in self.police.items():
+            for (i, ifname) in enumerate(ifnames):
+                commands = [
+                    'qdisc replace dev "{}" ingress'.format(ifname),
+                    'filter replace dev "{}" parent ffff: prio 1 matchall action police {}'.format(ifname, spec)
+                ]
+                if i == 0:
+                    for command in commands:
+                        exec('ip netns exec "{}" tc {}'.format(common.switch, command))
+                else:
+                    lines.extend(commands)
+
+        exec_batch('tc -n "{}" -batch -'.format(common.switch), lines)
+
+def exec_batch(cmd, lines, ignore_errors = False):
+    if len(lines) == 0:
+        return
+
+    if common.verbosity == 'verbose':
+        print('  {} ({} commands)'.format(cmd, len(lines)))
+
+    stderr = subprocess.DEVNULL if ignore_errors else None
+    with common.tracer.command(cmd):
+        process = subprocess.run(cmd, shell=True, input='\n'.join(lines) + '\n', universal_newlines=True, stderr=stderr)
+    if process.returncode != 0 and not ignore_errors:
+        raise CommandError(cmd)
+
+'''
+Get settings of an interface that are replayed by "ip link set dev <ifname> ..."
+'''
+def get_link_flags(link):
+    flags = ['up' if 'UP' in link['flags'] else 'down']
+    if 'NOARP' in link['flags']:
+        flags.append('arp off')
+    if 'MULTICAST' not in link['flags']:
+        flags.append('multicast off')
+    return flags
+
+'''
+Get all non-default root qdiscs, e.g.:
+qdisc tbf 8004: dev ve-a-b root refcnt 2 rate 1Mbit burst 8Kb lat 1ms
+=> {"ve-a-b": "tbf rate 1Mbit burst 8Kb lat 1ms"}
+'''
+def get_qdiscs(nsname):
+    qdiscs = {}
+    output = os.popen('tc -n "{}" qdisc show'.format(nsname)).read()
+    for line in output.split('\n'):
+        toks = line.split()
+        if len(toks) < 6 or toks[5] != 'root' or toks[1] in ('noqueue', 'noop'):
+            continue
+        options = toks[6:]
+        if len(options) >= 2 and options[0] == 'refcnt':
+            options = options[2:]
+        qdiscs[toks[4]] = ' '.join([toks[1]] + options)
+    return qdiscs
+
+def get_node_state(nsname):
+    flags = {}
+    addresses = {}
+    output = os.popen('ip -n "{}" -j addr show'.format(nsname)).read()
+    for link in json.loads(output or '[]'):
+        ifname = link['ifname']
+        flags[ifname] = get_link_flags(link)
+        for addr in link.get('addr_info', []):
+            # link local addresses are created by the kernel
+            if addr['scope'] == 'global':
+                addresses.setdefault(ifname, []).append('{}/{}'.format(addr['local'], addr['prefixlen']))
+    return (nsname, flags, addresses)
+
+# mirror targets of a downlink in order, see get_mirror_lines
+def get_mirrors(downname):
+    targets = []
+    output = os.popen('tc -n "{}" -j filter show dev "{}" ingress'.format(common.switch, downname)).read()
+    for entry in sorted(json.loads(output or '[]'), key=lambda entry: entry['pref']):
+        for action in entry.get('options', {}).get('actions', []):
+            if action.get('kind') == 'mirred':
+                targets.append(action['to_dev'])
+    return (downname, targets)
+
+# "bridge" or "mirred" for an existing network, None if there is none
+def get_data_plane():
+    if not os.path.exists('/var/run/netns/{}'.format(common.switch)):
+        return None
+    output = os.popen('ip -n "{}" -br link show type bridge'.format(common.switch)).read()
+    return 'bridge' if len(output.strip()) > 0 or len(common.get_nsnames()) == 0 else 'mirred'
+
+'''
+Capture the state of the network from the kernel, one dump per namespace.
+'''
+def capture_state():
+    state = {
+        'namespaces': common.get_nsnames(),
+        'bridges': {},
+        'uplinks': {},
+        'veths': [],
+        'masters': {},
+        'isolated': [],
+        'qdiscs': get_qdiscs(common.switch),
+        'mirrors': {},
+        'flags': {},
+        'addresses': {}
+    }
+
+    output = os.popen('ip -n "{}" -j -d link show 2> /dev/null'.format(common.switch)).read()
+    switch_flags = {}
+    for link in json.loads(output or '[]'):
+        ifname = link['ifname']
+        linkinfo = link.get('linkinfo', {})
+        kind = linkinfo.get('info_kind')
+        if kind == 'bridge':
+            data = linkinfo['info_data']
+            state['bridges'][ifname] = 'stp_state {} ageing_time {} forward_delay {}'.format(
+                data['stp_state'], data['ageing_time'], data['forward_delay'])
+        elif kind == 'veth' and ifname.startswith('dl-'):
+            # peer is the uplink in the nodes namespace
+            state['uplinks'][ifname] = common.get_nsname(ifname[3:])
+        elif kind == 'veth' and 'link' in link:
+            if ifname < link['link']:
+                state['veths'].append([ifname, link['link']])
+        else:
+            continue
+
+        if 'master' in link:
+            state['masters'][ifname] = link['master']
+        if linkinfo.get('info_slave_data', {}).get('isolated'):
+            state['isolated'].append(ifname)
+        switch_flags[ifname] = get_link_flags(link)
+
+    state['flags']['switch'] = switch_flags
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
+        for (nsname, flags, addresses) in executor.map(get_node_state, state['namespaces']):
+            state['flags'][nsname] = flags
+            if len(addresses) > 0:
+                state['addresses'][nsname] = addresses
+
+        # mirred data plane
+        if len(state['bridges']) == 0:
+            for (downname, targets) in executor.map(get_mirrors, state['uplinks']):
+                state['mirrors'][downname] = targets
+
+    return state
+
+'''
+Build the network from a manifest by bulk replay, without diffing or validation.
+'''
+def restore_state(state):
+    exec_batch('ip -batch -', ['netns add "{}"'.format(nsname) for nsname in [common.switch] + state['namespaces']])
+    exec('ip netns exec "{}" sysctl -q -w net.ipv6.conf.all.disable_ipv6=1'.format(common.switch))
+
+    lines = []
+    for (brname, options) in state['bridges'].items():
+        lines.append('link add name "{}" type bridge {}'.format(brname, options))
+    for (downname, nsname) in state['uplinks'].items():
+        lines.append('link add name "{}" type veth peer name "uplink" netns "{}"'.format(downname, nsname))
+    for (ifname1, ifname2) in state['veths']:
+        lines.append('link add name "{}" type veth peer name "{}"'.format(ifname1, ifname2))
+    for (ifname, master) in state['masters'].items():
+        lines.append('link set dev "{}" master "{}"'.format(ifname, master))
+    for (ifname, flags) in state['flags'].get('switch', {}).items():
+        lines.append('link set dev "{}" {}'.format(ifname, ' '.join(flags)))
+    exec_batch('ip -n "{}" -batch -'.format(common.switch), lines)
+
+    exec_batch('bridge -n "{}" -batch -'.format(common.switch), ['link set dev "{}" isolated on'.format(ifname) for ifname in state['isolated']])
+    exec_batch('tc -n "{}" -batch -'.format(common.switch), ['qdisc replace dev "{}" root {}'.format(ifname, qdisc) for (ifname, qdisc) in state['qdiscs'].items()])
+
+    lines = []
+    for (downname, targets) in state.get('mirrors', {}).items():
+        lines.append('qdisc add dev "{}" clsact'.format(downname))
+        lines.extend(get_mirror_lines(downname, targets))
+    exec_batch('tc -n "{}" -batch -'.format(common.switch), lines)
+
+    def restore_node(nsname):
+        lines = []
+        for (ifname, flags) in state['flags'].get(nsname, {}).items():
+            lines.append('link set dev "{}" {}'.format(ifname, ' '.join(flags)))
+        for (ifname, addresses) in state['addresses'].get(nsname, {}).items():
+            for address in addresses:
+                lines.append('addr add {} dev "{}"'.format(address, ifname))
+        exec_batch('ip -n "{}" -batch -'.format(nsname), lines)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(restore_node, state['namespaces']))
+
+'''
+Compare two states, returns a list of differences.
+'''
+def compare_state(expected, actual):
+    problems = []
+
+    def compare_items(what, expected_items, actual_items):
+        for key in expected_items:
+            if key not in actual_items:
+                problems.append('{} missing: {}'.format(what, key))
+            elif isinstance(expected_items, dict) and expected_items[key] != actual_items[key]:
+                problems.append('{} differs: {} (expected: {}, found: {})'.format(what, key, expected_items[key], actual_items[key]))
+        for key in actual_items:
+            if key not in expected_items:
+                problems.append('{} unexpected: {}'.format(what, key))
+
+    compare_items('namespace', set(expected['namespaces']), set(actual['namespaces']))
+    compare_items('bridge', expected['bridges'], actual['bridges'])
+    compare_items('uplink', expected['uplinks'], actual['uplinks'])
+    compare_items('veth pair', set(map(tuple, expected['veths'])), set(map(tuple, actual['veths'])))
+    compare_items('master', expected['masters'], actual['masters'])
+    compare_items('isolated port', set(expected['isolated']), set(actual['isolated']))
+    compare_items('qdisc', expected['qdiscs'], actual['qdiscs'])
+    compare_items('mirrors of', expected.get('mirrors', {}), actual['mirrors'])
+    for nsname in expected['flags']:
+        compare_items('interface in {}'.format(nsname), expected['flags'][nsname], actual['flags'].get(nsname, {}))
+    compare_items('addresses', expected['addresses'], actual['addresses'])
+
+    return problems
+
+'''
+Kill all processes in the given namespaces at once and wait for them to exit.
+Processes keep a namespace alive even after it was deleted.
+'''
+def kill_namespace_processes(nsnames, timeout_ms = 10000):
+    namespaces = set()
+    for nsname in nsnames:
+        try:
+            st = os.stat('/var/run/netns/{}'.format(nsname))
+            namespaces.add((st.st_dev, st.st_ino))
+        except OSError:
+            pass
+
+    pidfds = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            st = os.stat('/proc/{}/ns/net'.format(entry))
+            if (st.st_dev, st.st_ino) not in namespaces:
+                continue
+            pidfd = os.pidfd_open(int(entry))
+            signal.pidfd_send_signal(pidfd, signal.SIGKILL)
+            pidfds.append(pidfd)
+        except OSError:
+            # process is gone
+            continue
+
+    # a pidfd becomes readable when the process has exited
+    poller = select.poll()
+    for pidfd in pidfds:
+        poller.register(pidfd, select.POLLIN)
+
+    remaining = len(pidfds)
+    deadline = time.monotonic() + timeout_ms / 1000.0
+    while remaining > 0 and time.monotonic() < deadline:
+        for (pidfd, event) in poller.poll(max(0, int((deadline - time.monotonic()) * 1000))):
+            poller.unregister(pidfd)
+            remaining -= 1
+
+    for pidfd in pidfds:
+        os.close(pidfd)
+
+    if common.verbosity == 'verbose':
+        print('  killed {} processes'.format(len(pidfds) - remaining))
+
+    if remaining > 0:
+        print('Failed to kill {} processes'.format(remaining))
+
+'''
+Remove all namespaces of the lab, other labs are not touched. The
+kernel removes all devices of a namespace (bridges, veths) in one batch.
+'''
+def clear():
+    nsnames = common.get_nsnames()
+    if os.path.exists('/var/run/netns/{}'.format(common.switch)):
+        nsnames.append(common.switch)
+
+    with common.tracer.span('kill processes'):
+        kill_namespace_processes(nsnames)
+
+    # delete namespaces in parallel batches
+    batch_size = 64
+    batches = [nsnames[i:i + batch_size] for i in range(0, len(nsnames), batch_size)]
+
+    def delete_namespaces(batch):
+        exec_batch('ip -force -batch -', ['netns del "{}"'.format(nsname) for nsname in batch])
+
+    with common.tracer.span('delete namespaces'), concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(delete_namespaces, batches))
+
+
+'''
+Journal of the changes made by "change", one compact JSON list per line.
+An entry is added before the change is made, so partially applied
+changes are undone as well. Lines are written unbuffered to survive
+the death of the process (see "rollback"), fsync is done in batches.
+'''
+class Journal:
+    def __init__(self, path, sync_interval = 256):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.entries = []
+        self.unsynced = 0
+        self.file = open(path, 'w', buffering=1)
+
+    def add(self, *entry):
+        self.entries.append(list(entry))
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.unsynced += 1
+        if self.unsynced >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    # change completed or rolled back
+    def remove(self):
+        self.file.close()
+        os.remove(self.path)
+
+def read_journal(path):
+    entries = []
+    with open(path) as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # last line might be incomplete
+                break
+    return entries
+
+'''
+Undo journal entries in reverse order. Removals of created interfaces
+and namespaces are collected and run in forced batches, errors are
+ignored since the creation might not have been completed.
+'''
+def rollback(entries):
+    switch_lines = []
+    netns_lines = []
+    mirror_lines = []
+    tc = TrafficControl()
+
+    def flush():
+        exec_batch('tc -n "{}" -force -batch -'.format(common.switch), mirror_lines, True)
+        exec_batch('ip -n "{}" -force -batch -'.format(common.switch), switch_lines, True)
+        exec_batch('ip -force -batch -', netns_lines, True)
+        mirror_lines.clear()
+        switch_lines.clear()
+        netns_lines.clear()
+
+    if common.verbosity == 'verbose':
+        print('  rollback {} changes'.format(len(entries)))
+
+    for entry in reversed(entries):
+        kind = entry[0]
+        if kind == 'switch':
+            netns_lines.append('netns del "{}"'.format(common.switch))
+        elif kind == 'node':
+            # removes the uplink/downlink pair as well
+            switch_lines.append('link del "br-{}"'.format(entry[1]))
+            netns_lines.append('netns del "{}"'.format(common.get_nsname(entry[1])))
+        elif kind == 'link':
+            switch_lines.append('link del "ve-{}-{}"'.format(entry[1], entry[2]))
+        elif kind == 'mirror':
+            # the old neighbours
+            mirror_lines.extend(get_mirror_lines('dl-{}'.format(entry[1]), ['dl-{}'.format(name) for name in entry[3]]))
+        elif kind == 'tc':
+            # swap new and old settings
+            update_link(Link(*entry[2]), Link(*entry[1]), tc)
+        elif kind == 'unlink':
+            flush()
+            create_link(Link(*entry[1:]), tc)
+        elif kind == 'unnode':
+            flush()
+            create_node(Node(entry[1]))
+
+    flush()
+    tc.apply()
+
+class Link:
+    def __init__(self, source, target, source_tc, target_tc, source_police, target_police):
+        self.source = source
+        self.target = target
+        self.source_tc = source_tc
+        self.target_tc = target_tc
+        self.source_police = source_police
+        self.target_police = target_police
+
+    def cmp_tc(self, link):
+        return (self.source_tc == link.source_tc and self.target_tc == link.target_tc
+            and self.source_police == link.source_police and self.target_police == link.target_police)
+
+    # arguments of the constructor, for the journal
+    def fields(self):
+        return [self.source, self.target, self.source_tc, self.target_tc, self.source_police, self.target_police]
+
+# queueing disciplines known to tc
+known_qdiscs = {'netem', 'tbf', 'htb', 'hfsc', 'prio', 'pfifo', 'bfifo', 'pfifo_fast', 'sfq', 'red', 'choke',
+    'codel', 'fq_codel', 'fq', 'fq_pie', 'pie', 'cake', 'drr', 'qfq', 'ets', 'mqprio', 'taprio', 'cbs', 'etf', 'skbprio', 'plug'}
+
+'''
+Index the whole topology once and collect all problems
+(instead of stopping at the first one). Runs in linear time.
+Returns lists of problems, warnings and statistics lines.
+Duplicate links are only warnings, the last one is used.
+'''
+def validate_json(json_data):
+    problems = []
+    warnings = []
+
+    if not isinstance(json_data, dict) or not isinstance(json_data.get('links'), list):
+        return (['missing "links" list'], [], [])
+
+    ids = {}  # name => set of id types
+    links = {}  # (name1, name2) => index of first link
+    parent = {}
+
+    def add_id(value, where):
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            problems.append('{}: invalid id {}'.format(where, json.dumps(value)))
+            return None
+        name = str(value)
+        if name not in ids:
+            ids[name] = set()
+            parent[name] = name
+            if len(name) == 0:
+                problems.append('{}: empty name'.format(where))
+        ids[name].add(type(value))
+        return name
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def check_tc(value, key, where):
+        if value is None:
+            return
+        if common.data_plane == 'mirred' and not common.ignore_tc:
+            problems.append('{}: {} needs the bridge data plane (no link interfaces with "mirred")'.format(where, key))
+        elif not isinstance(value, str) or len(value.strip()) == 0:
+            problems.append('{}: {} is not a string'.format(where, key))
+        elif key.endswith('_tc') and value.split()[0] not in known_qdiscs:
+            problems.append('{}: unknown qdisc in {}: {}'.format(where, key, value))
+
+    degrees = {}
+    for (i, link) in enumerate(json_data['links']):
+        where = 'link {}'.format(i)
+        if not isinstance(link, dict) or 'source' not in link or 'target' not in link:
+            problems.append('{}: missing source or target'.format(where))
+            continue
+
+        source = add_id(link['source'], where)
+        target = add_id(link['target'], where)
+
+        for key in ('source_tc', 'target_tc', 'source_police', 'target_police'):
+            check_tc(link.get(key), key, where)
+
+        if source is None or target is None:
+            continue
+
+        if source == target:
+            problems.append('{}: self-loop on {}'.format(where, source))
+            continue
+
+        if (source, target) in links:
+            warnings.append('{}: duplicate of link {} ({} <-> {})'.format(where, links[(source, target)], source, target))
+            continue
+
+        if (target, source) in links:
+            warnings.append('{}: reversed duplicate of link {} ({} <-> {})'.format(where, links[(target, source)], source, target))
+            continue
+
+        links[(source, target)] = i
+        degrees[source] = degrees.get(source, 0) + 1
+        degrees[target] = degrees.get(target, 0) + 1
+
+        # union of both components
+        root1 = find(source)
+        root2 = find(target)
+        if root1 != root2:
+            parent[root1] = root2
+
+    # listed nodes without links are not created
+    unlinked = 0
+    for node in json_data.get('nodes', []):
+        if not isinstance(node, dict) or 'id' not in node:
+            problems.append('node without id: {}'.format(json.dumps(node)))
+        elif str(node['id']) not in ids:
+            unlinked += 1
+
+    mixed = [name for (name, types) in ids.items() if len(types) > 1]
+    for name in mixed:
+        problems.append('id {} is used as number and as string'.format(name))
+
+    types = set()
+    for t in ids.values():
+        types.update(t)
+    if len(types) > 1 and len(mixed) == 0:
+        problems.append('ids are a mix of numbers and strings')
+
+    # degree => number of nodes
+    distribution = {}
+    for name in ids:
+        degree = degrees.get(name, 0)
+        distribution[degree] = distribution.get(degree, 0) + 1
+
+    components = len(set(find(name) for name in ids))
+
+    info = []
+    info.append('nodes: {}'.format(len(ids)))
+    info.append('links: {}'.format(len(links)))
+    info.append('listed nodes without links: {}'.format(unlinked))
+    info.append('names mapped to short ids: {}'.format(sum(1 for name in ids if not names.is_short_name(name))))
+    info.append('components: {}'.format(components))
+    info.append('degree distribution (degree: nodes): {}'.format(
+        ', '.join('{}: {}'.format(degree, count) for (degree, count) in sorted(distribution.items()))))
+
+    return (problems, warnings, info)
+
+class Node:
+    def __init__(self, name):
+        self.name = name
+
+class Task:
+    def __init__(self):
+        self.links_create = []
+        self.links_update = []
+        self.links_remove = []
+        self.nodes_create = []
+        self.nodes_remove = []
+        # mirred data plane: (node, new neighbours, old neighbours) of changed and removed nodes
+        self.mirrors_update = []
+        # first nodes are created or last nodes are removed
+        self.create_switch = False
+        self.remove_switch = False
+
+def process_json(json_data, name_map):
+    links = {}
+    nodes = {}
+    for link in json_data['links']:
+        source = name_map.get_id(str(link['source']))
+        target = name_map.get_id(str(link['target']))
+        source_tc = link.get('source_tc')
+        target_tc = link.get('target_tc')
+        source_police = link.get('source_police')
+        target_police = link.get('target_police')
+
+        if source not in nodes:
+            nodes[source] = Node(source)
+
+        if target not in nodes:
+            nodes[target] = Node(target)
+
+        if source > target:
+            links[source + '_' + target] = Link(source, target, source_tc, target_tc, source_police, target_police)
+        else:
+            links[target + '_' + source] = Link(target, source, target_tc, source_tc, target_police, source_police)
+
+    return (links, nodes)
+
+# node => sorted list of neighbours
+def get_neighbours(links):
+    neighbours = {}
+    for link in links.values():
+        neighbours.setdefault(link.source, []).append(link.target)
+        neighbours.setdefault(link.target, []).append(link.source)
+    for node_neighbours in neighbours.values():
+        node_neighbours.sort()
+    return neighbours
+
+def apply_task(data, journal):
+    # add "switch" namespace
+    if data.create_switch:
+        if common.verbosity == 'verbose':
+            print('  create "switch"')
+        with common.tracer.span('create switch'):
+            # add switch if it does not exist yet
+            if not os.path.exists('/var/run/netns/{}'.format(common.switch)):
+                journal.add('switch')
+                exec('ip netns add "{}"'.format(common.switch))
+            # disable IPv6 in switch namespace (no need, less overhead)
+            exec('ip netns exec "{}" sysctl -q -w net.ipv6.conf.all.disable_ipv6=1'.format(common.switch))
+
+    tc = TrafficControl()
+
+    for (link, old) in data.links_update:
+        journal.add('tc', link.fields(), old.fields())
+        update_link(link, old, tc)
+
+    for node in data.nodes_create:
+        journal.add('node', node.name)
+        with common.tracer.span('create node', node=node.name):
+            create_node(node)
+
+    if common.data_plane == 'mirred':
+        # links are the mirror actions of both nodes, set in one batch
+        lines = []
+        for (name, neighbours, old) in data.mirrors_update:
+            journal.add('mirror', name, neighbours, old)
+            lines.extend(get_mirror_lines('dl-{}'.format(name), ['dl-{}'.format(neighbour) for neighbour in neighbours]))
+        with common.tracer.span('apply mirrors'):
+            exec_batch('tc -n "{}" -batch -'.format(common.switch), lines)
+    else:
+        for link in data.links_create:
+            journal.add('link', link.source, link.target)
+            with common.tracer.span('create link', source=link.source, target=link.target):
+                create_link(link, tc)
+
+        with common.tracer.span('apply tc'):
+            tc.apply()
+
+        for link in data.links_remove:
+            journal.add('unlink', *link.fields())
+            with common.tracer.span('remove link', source=link.source, target=link.target):
+                remove_link(link)
+
+    for node in data.nodes_remove:
+        journal.add('unnode', node.name)
+        with common.tracer.span('remove node', node=node.name):
+            remove_node(node)
+
+    # remove "switch" namespace
+    if data.remove_switch:
+        if common.verbosity == 'verbose':
+            print('  remove "switch"')
+        exec('ip netns del "{}" || true'.format(common.switch))
+
+'''
+A topology as read from a JSON file:
+{"nodes": [{"id": "a"}, ...], "links": [{"source": "a", "target": "b", "source_tc": "...", ...}, ...]}
+'''
+class Topology:
+    def __init__(self, json_data = None):
+        self.json_data = {'links': []} if json_data is None else json_data
+
+    # "none" is the empty topology
+    @staticmethod
+    def load(path):
+        if path == 'none':
+            return Topology()
+        with open(path) as file:
+            return Topology(json.load(file))
+
+    def is_empty(self):
+        return len(self.json_data['links']) == 0
+
+    # (problems, warnings, info), see validate_json
+    def validate(self):
+        return validate_json(self.json_data)
+
+    # get the task that changes this topology into the other
+    def diff(self, other, name_map):
+        (links_old, nodes_old) = process_json(self.json_data, name_map)
+        (links_new, nodes_new) = process_json(other.json_data, name_map)
+
+        data = Task()
+        data.create_switch = self.is_empty()
+        data.remove_switch = other.is_empty()
+
+        for key in links_new:
+            if not key in links_old:
+                data.links_create.append(links_new[key])
+
+        for key in links_old:
+            if key not in links_new:
+                data.links_remove.append(links_old[key])
+
+        for key in links_new:
+            if key in links_old:
+                new = links_new[key]
+                old = links_old[key]
+                if not new.cmp_tc(old):
+                    data.links_update.append((new, old))
+
+        for key in nodes_old:
+            if key not in nodes_new:
+                data.nodes_remove.append(nodes_old[key])
+
+        for key in nodes_new:
+            if key not in nodes_old:
+                data.nodes_create.append(nodes_new[key])
+
+        if common.data_plane == 'mirred':
+            neighbours_old = get_neighbours(links_old)
+            neighbours_new = get_neighbours(links_new)
+            # removed nodes as well, a rollback has to restore their mirrors
+            for key in list(nodes_new) + [key for key in nodes_old if key not in nodes_new]:
+                new = neighbours_new.get(key, [])
+                old = neighbours_old.get(key, [])
+                if new != old:
+                    data.mirrors_update.append((key, new, old))
+
+        return data
+
+'''
+The network of this host. Changes are journaled and
+undone if a command fails or the change is interrupted, e.g.:
+  lab = Lab()
+  lab.change(Topology.load('none'), Topology.load('graph.json'))
+'''
+class Lab:
+    # default paths are the state files of the lab instance, see common.set_lab
+    def __init__(self, journal_path = None, names_path = None):
+        self.journal_path = journal_path or common.get_state_path('network.journal')
+        self.name_map = names.NameMap(names_path or common.get_state_path('names.json'))
+
+    def get_nsnames(self):
+        return common.get_nsnames()
+
+    def has_journal(self):
+        return os.path.exists(self.journal_path)
+
+    # apply a task (see Topology.diff), raises CommandError after the rollback on failure
+    def apply(self, task):
+        # new ids are stored before namespaces with these ids exist
+        self.name_map.save()
+        journal = Journal(self.journal_path)
+
+        try:
+            apply_task(task, journal)
+        except (CommandError, KeyboardInterrupt):
+            journal.sync()
+            if common.verbosity != 'quiet':
+                print('Undo {} changes'.format(len(journal.entries)))
+            with common.tracer.span('rollback'):
+                rollback(journal.entries)
+            journal.remove()
+            raise
+
+        journal.remove()
+        if task.remove_switch:
+            self.name_map.remove()
+
+    def change(self, from_topology, to_topology):
+        with common.tracer.span('diff'):
+            task = from_topology.diff(to_topology, self.name_map)
+        self.apply(task)
+
+    # undo the journaled changes of an interrupted process
+    def rollback(self):
+        with common.tracer.span('rollback'):
+            rollback(read_journal(self.journal_path))
+        os.remove(self.journal_path)
+
+    def clear(self):
+        clear()
+        self.name_map.remove()
+
+    def snapshot(self):
+        with common.tracer.span('capture state'):
+            return capture_state()
+
+    def restore(self, state):
+        with common.tracer.span('restore state'):
+            restore_state(state)
+
+    # differences between a snapshot and the current state
+    def verify(self, state):
+        return compare_state(state, capture_state())
@@ -0,0 +1,81 @@
+'''
+Stable mapping of node names to short ids.
+
+Interface names like "ve-<source>-<target>" must fit into 15 characters
+(IFNAMSIZ), so a node name can have at most 5 characters. Short
+alphanumeric names are used as they are, all other names are mapped to
+"_" followed by a base62 number. The mapping is persisted, so a node
+keeps its id over multiple changes of the network.
+'''
+
+import json
+import os
+
+
+digits = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+max_name_length = 5
+id_length = max_name_length - 1
+
+def is_short_name(name):
+    return 0 < len(name) <= max_name_length and name.isascii() and name.isalnum()
+
+def encode(n):
+    s = ''
+    for _ in range(0, id_length):
+        s = digits[n % len(digits)] + s
+        n //= len(digits)
+    return '_' + s
+
+class NameMap:
+    def __init__(self, path):
+        self.path = path
+        # name => id and id => name, for mapped names only
+        self.ids = {}
+        self.names = {}
+        self.changed = False
+
+        if os.path.exists(path):
+            with open(path) as file:
+                self.ids = json.load(file)
+            self.names = {v: k for (k, v) in self.ids.items()}
+
+    # get the id of a node name, a new id is assigned if needed
+    def get_id(self, name):
+        if is_short_name(name):
+            return name
+
+        id = self.ids.get(name)
+        if id is None:
+            if len(self.ids) >= len(digits) ** id_length:
+                raise ValueError('too many node names to map')
+            id = encode(len(self.ids))
+            self.ids[name] = id
+            self.names[id] = name
+            self.changed = True
+        return id
+
+    # get the id of a known node name without assigning one, None if unknown
+    def find_id(self, name):
+        if is_short_name(name):
+            return name
+        return self.ids.get(name)
+
+    # get the original node name of an id
+    def get_name(self, id):
+        return self.names.get(id, id)
+
+    def save(self):
+        if not self.changed:
+            return
+        # replace atomically
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self.ids, file, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        self.changed = False
+
+    def remove(self):
+        self.ids = {}
+        self.names = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
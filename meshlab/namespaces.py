@@ -0,0 +1,265 @@
+'''
+Execute functions inside of network namespaces without forking
+a shell and "ip netns exec" for every call (see NamespaceWorkers).
+'''
+
+import multiprocessing.connection
+import multiprocessing
+import subprocess
+import ctypes
+import socket
+import struct
+import fcntl
+import time
+import os
+
+from .common import LabError, get_display_name, format_bytes
+from . import common
+
+
+CLONE_NEWNET = 0x40000000
+SIOCGIFHWADDR = 0x8927
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+# enter a network namespace (os.setns needs Python 3.12)
+def setns(nsname):
+    fd = os.open('/var/run/netns/{}'.format(nsname), os.O_RDONLY)
+    try:
+        if libc.setns(fd, CLONE_NEWNET) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'setns {}: {}'.format(nsname, os.strerror(errno)))
+    finally:
+        os.close(fd)
+
+'''
+Call func(*fargs) in every namespace from the calling thread, which
+returns to its own namespace afterwards. Sockets created by func stay
+in their namespace. Returns the results in order.
+'''
+def map_in_thread(func, nsnames, *fargs):
+    own = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+        results = []
+        for nsname in nsnames:
+            setns(nsname)
+            results.append(func(*fargs))
+        return results
+    finally:
+        rc = libc.setns(own, CLONE_NEWNET)
+        errno = ctypes.get_errno()
+        os.close(own)
+        if rc != 0:
+            raise OSError(errno, 'setns back: {}'.format(os.strerror(errno)))
+
+'''
+Functions executed by the namespace workers (see NamespaceWorkers).
+/proc/self/net always shows the namespace of the calling process,
+unlike /sys that would need to be remounted.
+'''
+
+# get rx_bytes, rx_packets, tx_bytes, tx_packets of an interface
+def read_interface_statistics(interface):
+    with open('/proc/self/net/dev') as file:
+        for line in file:
+            (name, sep, values) = line.partition(':')
+            if sep and name.strip() == interface:
+                toks = values.split()
+                return (int(toks[0]), int(toks[1]), int(toks[8]), int(toks[9]))
+    raise OSError('interface not found: {}'.format(interface))
+
+# transmit counters of all link interfaces (executed by a namespace worker in "switch")
+def read_link_statistics():
+    stats = {}
+    with open('/proc/self/net/dev') as file:
+        for line in file:
+            (name, sep, values) = line.partition(':')
+            name = name.strip()
+            if sep and name.startswith('ve-'):
+                toks = values.split()
+                stats[name] = (int(toks[8]), int(toks[9]))
+    return stats
+
+# get IPv6 address, use fe80:: address as fallback
+# TODO: return IPv6 address of the broadest scope in general
+def read_ipv6_address(interface):
+    lladdr = None
+    with open('/proc/self/net/if_inet6') as file:
+        for line in file:
+            toks = line.split()
+            if toks[5] != interface:
+                continue
+            addr = socket.inet_ntop(socket.AF_INET6, bytes.fromhex(toks[0]))
+            if addr.startswith('fe80'):
+                lladdr = addr
+            else:
+                return addr
+    return lladdr
+
+def read_mac_address(interface):
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        try:
+            info = fcntl.ioctl(sock.fileno(), SIOCGIFHWADDR, struct.pack('256s', interface.encode()[:15]))
+        except OSError:
+            return None
+        return ':'.join('{:02x}'.format(b) for b in info[18:24])
+
+# run a command (list of arguments), optionally with input on stdin
+def run_command(command, input = None):
+    process = subprocess.run(command, input=input, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if process.returncode != 0:
+        raise OSError('command failed: {}\n{}'.format(' '.join(command), process.stdout.strip()))
+    return process.stdout
+
+def namespace_worker(conn):
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        (nsname, func, fargs) = request
+        try:
+            # compare inodes, not names: a namespace might have been
+            # deleted and created again under the same name
+            if os.stat('/var/run/netns/{}'.format(nsname)).st_ino != os.stat('/proc/self/ns/net').st_ino:
+                setns(nsname)
+            conn.send((True, func(*fargs)))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+'''
+Pool of long-lived worker processes. Each worker enters the namespace
+of a request via setns() and executes a function there. This avoids
+forking a shell and "ip netns exec" for every command.
+'''
+class NamespaceWorkers:
+    def __init__(self, count):
+        context = multiprocessing.get_context('fork')
+        self.conns = []
+        self.processes = []
+        self.closed = False
+        for _ in range(0, count):
+            (parent_conn, child_conn) = context.Pipe()
+            process = context.Process(target=namespace_worker, args=(child_conn,), daemon=True)
+            process.start()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+    # stop all workers, get_workers() starts a new pool
+    def close(self):
+        self.closed = True
+        for process in self.processes:
+            process.kill()
+        for conn in self.conns:
+            conn.close()
+
+    # call func(*fargs) in namespace nsname
+    def call(self, nsname, func, *fargs):
+        return self.map(func, [nsname], *fargs)[0]
+
+    '''
+    Call func(*fargs) in every namespace, returns the results in order.
+    On failure, the replies of all running requests are still collected
+    (so none is left in a pipe for the next call) before LabError is raised.
+    '''
+    def map(self, func, nsnames, *fargs):
+        results = [None] * len(nsnames)
+        pending = list(enumerate(nsnames))
+        busy = {}
+        error = None
+
+        try:
+            # one request per worker at a time
+            for conn in self.conns:
+                if len(pending) == 0:
+                    break
+                (i, nsname) = pending.pop()
+                conn.send((nsname, func, fargs))
+                busy[conn] = i
+
+            while len(busy) > 0:
+                for conn in multiprocessing.connection.wait(list(busy)):
+                    i = busy.pop(conn)
+                    (ok, result) = conn.recv()
+                    if not ok and error is None:
+                        error = '{} failed in {}: {}'.format(func.__name__, get_display_name(nsnames[i]), result)
+                    results[i] = result
+                    if len(pending) > 0 and error is None:
+                        (i, nsname) = pending.pop()
+                        conn.send((nsname, func, fargs))
+                        busy[conn] = i
+        except BaseException:
+            # interrupted with requests in flight
+            self.close()
+            raise
+
+        if error is not None:
+            raise LabError(error)
+
+        return results
+
+workers = None
+
+def get_workers():
+    global workers
+    if workers is None or workers.closed:
+        workers = NamespaceWorkers(min(32, 2 * common.get_cpu_count()))
+    return workers
+
+class TrafficStatisticSummary:
+    def __init__(self):
+        self.rx_bytes = 0
+        self.rx_packets = 0
+        self.tx_bytes = 0
+        self.tx_packets = 0
+
+    def print(self):
+        print('received {} ({} bytes, {} packets), send: {} ({} bytes, {} packets)'.format(
+            format_bytes(self.rx_bytes), self.rx_bytes, self.rx_packets,
+            format_bytes(self.tx_bytes), self.tx_bytes, self.tx_packets
+        ))
+
+SIOCGIFFLAGS = 0x8913
+SIOCSIFFLAGS = 0x8914
+IFF_UP = 0x1
+
+# set interfaces up or down (executed by a namespace worker in "switch"), returns the time of the change
+def set_interfaces_up(ifnames, up):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for ifname in ifnames:
+            ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFFLAGS, struct.pack('16sH22x', ifname.encode(), 0))
+            (flags,) = struct.unpack_from('H', ifreq, 16)
+            flags = (flags | IFF_UP) if up else (flags & ~IFF_UP)
+            fcntl.ioctl(sock.fileno(), SIOCSIFFLAGS, struct.pack('16sH22x', ifname.encode(), flags))
+    return time.monotonic_ns()
+
+RTM_DELLINK = 17
+NLMSG_ERROR = 2
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+
+# delete interfaces over rtnetlink (executed by a namespace worker)
+def delete_interfaces(ifnames):
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+        for (seq, ifname) in enumerate(ifnames, 1):
+            # nlmsghdr and ifinfomsg, the kernel acknowledges with an error code
+            index = socket.if_nametoindex(ifname)
+            sock.send(struct.pack('=IHHII', 32, RTM_DELLINK, NLM_F_REQUEST | NLM_F_ACK, seq, 0)
+                + struct.pack('=BxHiII', socket.AF_UNSPEC, 0, index, 0, 0))
+            reply = sock.recv(4096)
+            (msg_type,) = struct.unpack_from('=H', reply, 4)
+            (error,) = struct.unpack_from('=i', reply, 16)
+            if msg_type == NLMSG_ERROR and error != 0:
+                raise OSError(-error, 'delete {}: {}'.format(ifname, os.strerror(-error)))
+
+def get_traffic_statistics(nsnames):
+    # fetch uplink statistics
+    ret = TrafficStatisticSummary()
+
+    with common.tracer.span('traffic statistics'):
+        for (rx_bytes, rx_packets, tx_bytes, tx_packets) in get_workers().map(read_interface_statistics, nsnames, 'uplink'):
+            ret.rx_bytes += rx_bytes
+            ret.rx_packets += rx_packets
+            ret.tx_bytes += tx_bytes
+            ret.tx_packets += tx_packets
+
+    return ret
@@ -0,0 +1,810 @@
+'''
+Measurements on a running network: reachability (ICMPv6 echo), traffic
+flows and per link traffic.
+'''
+
+import multiprocessing
+import subprocess
+import itertools
+import selectors
+import ctypes
+import random
+import socket
+import struct
+import json
+import math
+import time
+import os
+
+from .common import LabError, millis, get_display_name, add_csv_header, format_bytes
+from .lab import get_data_plane
+from .namespaces import libc, setns, map_in_thread, get_workers, read_ipv6_address, read_link_statistics, get_traffic_statistics
+from . import common
+
+
+# get system load from uptime command
+# average of the last 1, 5 and 15 minutes
+def get_load_average():
+    p = subprocess.Popen(['uptime'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    (out, err) = p.communicate()
+    t = out.decode().split('load average:')[1].split(',')
+    return (float(t[0]), float(t[1]), float(t[2]))
+
+'''
+Get the namespaces of all nodes marked as gateway in a topology file,
+e.g. {"nodes": [{"id": "1", "gateway": true}], "links": [...]}
+'''
+def get_gateway_index(path, nsnames):
+    with open(path) as file:
+        data = json.load(file)
+
+    existing = set(nsnames)
+    gateways = []
+    for node in data.get('nodes', []):
+        if node.get('gateway', False):
+            id = common.name_map.find_id(str(node['id']))
+            if id is not None and common.get_nsname(id) in existing:
+                gateways.append(common.get_nsname(id))
+
+    return gateways
+
+'''
+Get random unique pairs, all pairs if npairs is larger than their number.
+A share of them has a gateway as target and a non-gateway as source
+(another gateway if every node is a gateway), the rest is random.
+'''
+def get_gateway_samples(items, gateways, npairs, share):
+    n = len(items)
+    if n < 2:
+        return []
+
+    gateway_set = set(gateways)
+    gateways = [item for item in items if item in gateway_set]
+    others = [item for item in items if item not in gateway_set]
+    npairs = min(npairs, n * (n - 1))
+    gateway_count = int(round(npairs * share))
+
+    if len(others) == 0:
+        samples = get_random_samples(gateways, gateway_count)
+    else:
+        # pair k of the gateway pairs is (others[k // g], gateways[k % g])
+        g = len(gateways)
+        samples = [(others[k // g], gateways[k % g]) for k in random.sample(range(len(others) * g), min(gateway_count, len(others) * g))]
+
+    # fill up with random pairs
+    chosen = set(samples)
+    while len(samples) < npairs:
+        i = random.randrange(n)
+        j = random.randrange(n - 1)
+        if j >= i:
+            j += 1
+        if (items[i], items[j]) not in chosen:
+            chosen.add((items[i], items[j]))
+            samples.append((items[i], items[j]))
+
+    random.shuffle(samples)
+    return samples
+
+'''
+Get random unique pairs, all pairs if npairs is larger than their number.
+Pair k of the n * (n - 1) possible pairs is (items[i], items[j]) with
+i = k // (n - 1) and j = k % (n - 1), skipping i itself.
+'''
+def get_random_samples(items, npairs):
+    n = len(items)
+    if n < 2:
+        return []
+
+    samples = []
+    for k in random.sample(range(n * (n - 1)), min(npairs, n * (n - 1))):
+        i = k // (n - 1)
+        j = k % (n - 1)
+        if j >= i:
+            j += 1
+        samples.append((items[i], items[j]))
+
+    return samples
+
+ICMP6_FILTER = 1
+ICMP6_ECHO_REQUEST = 128
+ICMP6_ECHO_REPLY = 129
+
+# type, code, checksum (set by the kernel), identifier, sequence, send time in ns, index of the probe
+echo_header = struct.Struct('!BBHHHQI')
+
+# raw socket that only receives echo replies
+def get_echo_socket():
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_RAW, socket.IPPROTO_ICMPV6)
+    # a set bit blocks the ICMPv6 type
+    words = [0xffffffff] * 8
+    words[ICMP6_ECHO_REPLY >> 5] &= ~(1 << (ICMP6_ECHO_REPLY & 31))
+    sock.setsockopt(socket.IPPROTO_ICMPV6, ICMP6_FILTER, struct.pack('8I', *words))
+    sock.setblocking(False)
+    return sock
+
+CLOCK_MONOTONIC = 1
+TFD_TIMER_ABSTIME = 1
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+class itimerspec(ctypes.Structure):
+    _fields_ = [('it_interval', timespec), ('it_value', timespec)]
+
+'''
+Run a number of events at intended times over a duration, either evenly
+spaced or with exponentially distributed gaps (Poisson arrivals). The
+intended times are fixed in advance (relative to the start), so a late
+event does not delay the following ones. A timerfd with absolute
+expiry on the monotonic clock is used to sleep until the next event.
+With a selector, the callbacks (key.data) of other files that get
+ready are run while waiting.
+'''
+class ProbeScheduler:
+    def __init__(self, count, duration_ms, arrival = 'even', offsets_ns = None):
+        duration_ns = int(duration_ms * 1000000)
+        if offsets_ns is not None:
+            # fixed schedule
+            self.offsets_ns = sorted(offsets_ns)
+        elif arrival == 'poisson':
+            gaps = [random.expovariate(1.0) for _ in range(0, count)]
+            scale = duration_ns / max(math.fsum(gaps), 1e-9)
+            self.offsets_ns = list(int(t * scale) for t in itertools.accumulate([0.0] + gaps[:-1]))
+        else:
+            self.offsets_ns = [(i * duration_ns) // max(count, 1) for i in range(0, count)]
+        # actual minus intended send time
+        self.lateness_ns = []
+        self.start_ns = None
+
+    def wait_until(self, fd, deadline_ns, selector):
+        spec = itimerspec()
+        spec.it_value.tv_sec = deadline_ns // 1000000000
+        spec.it_value.tv_nsec = deadline_ns % 1000000000
+        if libc.timerfd_settime(fd, TFD_TIMER_ABSTIME, ctypes.byref(spec), None) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'timerfd_settime: {}'.format(os.strerror(errno)))
+
+        if selector is None:
+            # blocks until the timer expired (immediately if the deadline has passed)
+            os.read(fd, 8)
+            return
+
+        expired = False
+        while not expired:
+            for (key, _) in selector.select():
+                if key.fileobj == fd:
+                    os.read(fd, 8)
+                    expired = True
+                else:
+                    key.data(key.fileobj)
+
+    # call func(index) for every event
+    def run(self, func, selector = None):
+        fd = libc.timerfd_create(CLOCK_MONOTONIC, os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'timerfd_create: {}'.format(os.strerror(errno)))
+        if selector is not None:
+            selector.register(fd, selectors.EVENT_READ, None)
+
+        try:
+            self.start_ns = time.monotonic_ns()
+            for (i, offset_ns) in enumerate(self.offsets_ns):
+                intended_ns = self.start_ns + offset_ns
+                if time.monotonic_ns() < intended_ns:
+                    self.wait_until(fd, intended_ns, selector)
+                self.lateness_ns.append(time.monotonic_ns() - intended_ns)
+                func(i)
+        finally:
+            if selector is not None:
+                selector.unregister(fd)
+            os.close(fd)
+
+    # (average, 99th percentile, maximum) lateness in milliseconds
+    def get_lateness_ms(self):
+        if len(self.lateness_ns) == 0:
+            return (0.0, 0.0, 0.0)
+        values = sorted(self.lateness_ns)
+        avg = math.fsum(values) / len(values)
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        return (avg / 1000000.0, p99 / 1000000.0, values[-1] / 1000000.0)
+
+'''
+Get the addresses of namespaces on an interface, all missing ones at once.
+Found addresses are kept in the cache (dict) if one is given.
+'''
+def resolve_addresses(nsnames, interface, cache = None):
+    if cache is None:
+        cache = {}
+    missing = [nsname for nsname in set(nsnames) if nsname not in cache]
+    if len(missing) > 0:
+        with common.tracer.span('resolve addresses'):
+            for (nsname, address) in zip(missing, get_workers().map(read_ipv6_address, missing, interface)):
+                # no address yet (protocol not started), look up again next time
+                if address is not None:
+                    cache[nsname] = address
+    return {nsname: cache.get(nsname) for nsname in nsnames}
+
+def run_test(nsnames, interface, path_count = 10, test_duration_ms = 1000, wait_ms = 0, outfile = None, gateways = None, arrival = 'even', gateway_share = 0.8, address_cache = None):
+    # replies later than this are lost
+    reply_deadline_ns = 1000000000
+
+    pairs_beg_ms = millis()
+    with common.tracer.span('pairs generation'):
+        if gateways is None:
+            pairs = list(get_random_samples(nsnames, path_count))
+        else:
+            pairs = list(get_gateway_samples(nsnames, gateways, path_count, gateway_share))
+    pairs_end_ms = millis()
+
+    addresses = resolve_addresses([nstarget for (nssource, nstarget) in pairs], interface, address_cache)
+
+    ts_beg_beg_ms = millis()
+    ts_beg = get_traffic_statistics(nsnames)
+    ts_beg_end_ms = millis()
+
+    if common.verbosity != 'quiet':
+        print('interface: {}, test duration: {}ms, pairs generation time: {}ms, traffic measurement time: {}ms'.format(
+            interface,
+            test_duration_ms,
+            (pairs_end_ms - pairs_beg_ms),
+            (ts_beg_end_ms - ts_beg_beg_ms)
+        ))
+
+        if wait_ms > 0:
+            print('wait for {} seconds for pings to start.'.format(wait_ms / 1000.0))
+
+    time.sleep(wait_ms / 1000.0)
+
+    # one raw socket per source, created from this thread in the namespace of
+    # the source (no process per probe), replies are received while waiting
+    def open_echo_socket():
+        try:
+            scope_id = socket.if_nametoindex(interface)
+        except OSError:
+            scope_id = None
+        return (get_echo_socket(), scope_id)
+
+    sources = sorted(set(nssource for (nssource, _) in pairs))
+    sockets = {}
+    selector = selectors.DefaultSelector()
+    # pair index => RTT in ns
+    rtts = {}
+
+    def get_receiver(nssource, identifier):
+        def receive(sock):
+            while True:
+                try:
+                    data = sock.recv(1024)
+                except BlockingIOError:
+                    break
+                received_ns = time.monotonic_ns()
+                if len(data) < echo_header.size:
+                    continue
+                (kind, _, _, reply_identifier, _, send_ns, i) = echo_header.unpack_from(data)
+                if kind != ICMP6_ECHO_REPLY or reply_identifier != identifier or i >= len(pairs) or pairs[i][0] != nssource:
+                    continue
+                if i not in rtts and received_ns - send_ns <= reply_deadline_ns:
+                    rtts[i] = received_ns - send_ns
+        return receive
+
+    for (k, (nssource, (sock, scope_id))) in enumerate(zip(sources, map_in_thread(open_echo_socket, sources))):
+        identifier = (os.getpid() + k) & 0xffff
+        sockets[nssource] = (sock, scope_id, identifier)
+        selector.register(sock, selectors.EVENT_READ, get_receiver(nssource, identifier))
+
+    def receive_until(deadline_ns):
+        while len(rtts) < len(pairs):
+            timeout_ns = deadline_ns - time.monotonic_ns()
+            if timeout_ns <= 0:
+                break
+            for (key, _) in selector.select(timeout_ns / 1000000000.0):
+                key.data(key.fileobj)
+
+    def send_echo(i):
+        (nssource, nstarget) = pairs[i]
+        nstarget_addr = addresses[nstarget]
+
+        if common.verbosity == 'verbose':
+            print('[{:06}] Ping {} => {} ({} / {})'.format(millis() - start_ms, get_display_name(nssource), get_display_name(nstarget), nstarget_addr, interface))
+
+        (sock, scope_id, identifier) = sockets[nssource]
+        link_local = nstarget_addr is not None and nstarget_addr.startswith('fe80')
+        if nstarget_addr is None or (link_local and scope_id is None):
+            # no address or no interface => no reply
+            return
+        try:
+            sock.sendto(echo_header.pack(ICMP6_ECHO_REQUEST, 0, 0, identifier, i & 0xffff, time.monotonic_ns(), i),
+                (nstarget_addr, 0, 0, scope_id if link_local else 0))
+        except OSError:
+            # no route or send buffer full => no reply
+            pass
+
+    scheduler = ProbeScheduler(len(pairs), test_duration_ms, arrival)
+    start_ms = millis()
+    try:
+        with common.tracer.span('probing', pings=len(pairs)):
+            scheduler.run(send_echo, selector)
+        stop1_ms = millis()
+
+        if common.verbosity != 'quiet':
+            print('schedule: {} pings ({}), lateness avg: {:0.3f}ms, p99: {:0.3f}ms, max: {:0.3f}ms'.format(
+                len(pairs), arrival, *scheduler.get_lateness_ms()))
+
+        # wait until test_duration_ms is over
+        with common.tracer.span('wait'):
+            receive_until((start_ms + test_duration_ms) * 1000000)
+
+        stop2_ms = millis()
+
+        ts_end = get_traffic_statistics(nsnames)
+
+        # replies to the last probes (prolongs testing up to 1 second!)
+        with common.tracer.span('collection'):
+            receive_until(stop1_ms * 1000000 + reply_deadline_ns)
+    finally:
+        for (sock, _, _) in sockets.values():
+            sock.close()
+        selector.close()
+
+    result_packets_send = len(pairs)
+    result_packets_received = len(rtts)
+    result_rtt_avg = 0.0 if result_packets_received == 0 else (math.fsum(rtts.values()) / result_packets_received / 1000000.0)
+    result_duration_ms = stop1_ms - start_ms
+    result_filler_ms = stop2_ms - stop1_ms
+    result_ingress_avg_node_kbs = 0.0 if (len(nsnames) == 0) else (1000.0 * (ts_end.rx_bytes - ts_beg.rx_bytes) / (stop2_ms - start_ms) / len(nsnames))
+    result_egress_avg_node_kbs = 0.0 if (len(nsnames) == 0) else (1000.0 * (ts_end.tx_bytes - ts_beg.tx_bytes) / (stop2_ms - start_ms) / len(nsnames))
+    result_lost = 0 if (result_packets_send == 0) else (100.0 - 100.0 * (result_packets_received / result_packets_send))
+    lavg = get_load_average()
+
+    if outfile is not None:
+        header = (
+            'load_avg1 load_avg5 load_avg15 '
+            'node_count '
+            'packets_send '
+            'packets_received '
+            'sample_duration_ms '
+            'rtt_avg_ms '
+            'egress_avg_node_kbs '
+            'ingress_avg_node_kbs\n'
+        )
+
+        # add csv header if not present
+        add_csv_header(outfile, header.replace(' ', common.csv_delimiter))
+
+        outfile.write('{:0.2f} {:0.2f} {:0.2f} {} {} {} {} {} {:0.2f} {:0.2f}\n'.format(
+            lavg[0], lavg[1], lavg[2],
+            len(nsnames),
+            result_packets_send,
+            result_packets_received,
+            int(result_duration_ms + result_filler_ms),
+            int(result_rtt_avg),
+            result_egress_avg_node_kbs,
+            result_ingress_avg_node_kbs
+        ).replace(' ', common.csv_delimiter))
+
+    if common.verbosity != 'quiet':
+        print('send: {}, received: {}, load: {}/{}/{}, lost: {:0.2f}%, measurement span: {}ms + {}ms, egress: {}/s/node, ingress: {}/s/node'.format(
+            result_packets_send,
+            result_packets_received,
+            lavg[0], lavg[1], lavg[2],
+            result_lost,
+            result_duration_ms,
+            result_filler_ms,
+            format_bytes(result_egress_avg_node_kbs),
+            format_bytes(result_ingress_avg_node_kbs)
+        ))
+
+    return {
+        'node_count': len(nsnames),
+        'packets_send': result_packets_send,
+        'packets_received': result_packets_received,
+        'sample_duration_ms': result_duration_ms + result_filler_ms,
+        'rtt_avg_ms': result_rtt_avg,
+        'egress_avg_node_kbs': result_egress_avg_node_kbs,
+        'ingress_avg_node_kbs': result_ingress_avg_node_kbs
+    }
+
+# flow id, sequence number, send time in ns (CLOCK_MONOTONIC is the same in all namespaces)
+flow_header = struct.Struct('!IIQ')
+
+class Flow:
+    def __init__(self, id, source, target, port):
+        self.id = id
+        self.source = source
+        self.target = target
+        self.port = port
+        self.address = None
+        self.packets_send = 0
+        self.packets_received = 0
+        self.bytes_received = 0
+        self.latency_sum_ns = 0
+        self.latency_max_ns = 0
+        # send time of the first packet
+        self.start_ns = 0
+        # optional, received[seq] is set to 1 for every received packet
+        self.received = None
+
+'''
+Get (source, target) pairs for traffic flows:
+uniform: random sources and targets
+gateway: random sources, all flows to one gateway (all-to-one) or the gateways of the topology
+hotspot: 80% of the flows go to 10% of the nodes
+'''
+def get_flow_pairs(nsnames, count, pattern, gateway = None, gateway_index = None):
+    pairs = []
+
+    if len(nsnames) < 2:
+        return pairs
+
+    if pattern == 'gateway':
+        if gateway is not None:
+            gateways = [gateway]
+        elif gateway_index is None:
+            gateways = [random.choice(nsnames)]
+        else:
+            gateways = gateway_index
+        gateway_set = set(gateways)
+        sources = [nsname for nsname in nsnames if nsname not in gateway_set]
+        if len(gateways) == 0:
+            raise LabError('pattern "gateway" needs at least one gateway')
+        if len(sources) == 0:
+            raise LabError('pattern "gateway" needs nodes that are no gateway')
+        for _ in range(0, count):
+            pairs.append((random.choice(sources), random.choice(gateways)))
+    else:
+        hotspots = random.sample(nsnames, max(1, len(nsnames) // 10))
+        while len(pairs) < count:
+            source = random.choice(nsnames)
+            if pattern == 'hotspot' and random.random() < 0.8:
+                target = random.choice(hotspots)
+            else:
+                target = random.choice(nsnames)
+            if source != target:
+                pairs.append((source, target))
+
+    return pairs
+
+def get_sockaddr(address, port, interface):
+    # link local addresses need the interface index of the sending namespace
+    scope_id = socket.if_nametoindex(interface) if address.startswith('fe80') else 0
+    return (address, port, 0, scope_id)
+
+'''
+Send and receive the packets of a set of flows in one process.
+Sockets stay in the namespace they were created in, so a single
+event loop can serve all flows. Packets that are due are sent
+in a batch on every wakeup.
+'''
+def exchange_flows(flows, transport, interface, rate, size, duration_ms):
+    selector = selectors.DefaultSelector()
+    senders = []
+
+    for flow in flows:
+        # bind or connect errors (address still tentative, no route) count all packets as lost
+        receiver = None
+        sender = None
+
+        setns(flow.target)
+        if transport == 'udp':
+            receiver = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            try:
+                receiver.bind(get_sockaddr(flow.address, flow.port, interface))
+            except OSError:
+                receiver.close()
+                receiver = None
+        else:
+            listener = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                listener.bind(get_sockaddr(flow.address, flow.port, interface))
+                listener.listen(1)
+            except OSError:
+                listener.close()
+                listener = None
+
+        setns(flow.source)
+        if transport == 'udp':
+            sender = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            try:
+                sender.connect(get_sockaddr(flow.address, flow.port, interface))
+            except OSError:
+                sender.close()
+                sender = None
+        elif listener is not None:
+            sender = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            sender.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sender.settimeout(5)
+            try:
+                sender.connect(get_sockaddr(flow.address, flow.port, interface))
+                (receiver, _) = listener.accept()
+            except OSError:
+                sender.close()
+                sender = None
+            listener.close()
+
+        if sender is not None:
+            sender.setblocking(False)
+        senders.append((flow, sender))
+        if receiver is not None:
+            receiver.setblocking(False)
+            selector.register(receiver, selectors.EVENT_READ, (flow, bytearray()))
+
+    interval_ns = int(1000000000 / rate)
+    padding = bytes(max(0, size - flow_header.size))
+    start_ns = time.monotonic_ns()
+    # spread the first packets of all flows over one interval
+    next_ns = [start_ns + (i * interval_ns) // max(1, len(senders)) for i in range(0, len(senders))]
+    for i, (flow, sender) in enumerate(senders):
+        flow.start_ns = next_ns[i]
+    stop_ns = start_ns + duration_ms * 1000000
+    backlogs = [bytearray() for _ in senders] if transport == 'tcp' else []
+    # receive packets still in flight for one more second
+    end_ns = stop_ns + 1000000000
+
+    while True:
+        now_ns = time.monotonic_ns()
+        if now_ns >= end_ns:
+            break
+
+        if now_ns < stop_ns:
+            for i, (flow, sender) in enumerate(senders):
+                while next_ns[i] <= now_ns:
+                    next_ns[i] += interval_ns
+                    flow.packets_send += 1
+                    if sender is None:
+                        continue
+                    packet = flow_header.pack(flow.id, flow.packets_send, time.monotonic_ns()) + padding
+                    if transport == 'tcp':
+                        # partial sends must not break the stream, queue up to 64 packets
+                        if len(backlogs[i]) < 64 * size:
+                            backlogs[i].extend(packet)
+                        continue
+                    try:
+                        sender.send(packet)
+                    except OSError:
+                        # send buffer full or no route => lost
+                        pass
+
+        for i, backlog in enumerate(backlogs):
+            if len(backlog) > 0:
+                try:
+                    del backlog[:senders[i][1].send(backlog)]
+                except OSError:
+                    pass
+
+        timeout_ns = end_ns - now_ns
+        if now_ns < stop_ns and len(next_ns) > 0:
+            timeout_ns = min(timeout_ns, min(next_ns) - now_ns)
+        if any(len(backlog) > 0 for backlog in backlogs):
+            # retry queued data soon
+            timeout_ns = min(timeout_ns, 1000000)
+
+        for (key, _) in selector.select(max(0, timeout_ns) / 1000000000.0):
+            (flow, buffer) = key.data
+            receiver = key.fileobj
+            while True:
+                try:
+                    data = receiver.recv(65536)
+                except BlockingIOError:
+                    break
+                if len(data) == 0:
+                    selector.unregister(receiver)
+                    break
+                received_ns = time.monotonic_ns()
+                if transport == 'tcp':
+                    # split stream into packets of the configured size
+                    buffer.extend(data)
+                    packets = []
+                    while len(buffer) >= size:
+                        packets.append(bytes(buffer[:size]))
+                        del buffer[:size]
+                else:
+                    packets = [data]
+
+                for packet in packets:
+                    (_, seq, send_ns) = flow_header.unpack_from(packet)
+                    if flow.received is not None and seq < len(flow.received):
+                        flow.received[seq] = 1
+                    latency_ns = received_ns - send_ns
+                    flow.packets_received += 1
+                    flow.bytes_received += len(packet)
+                    flow.latency_sum_ns += latency_ns
+                    flow.latency_max_ns = max(flow.latency_max_ns, latency_ns)
+
+    return flows
+
+# process of start_flow_processes, errors are sent back instead of the flows
+def run_flows(flows, transport, interface, rate, size, duration_ms, conn):
+    try:
+        conn.send((True, exchange_flows(flows, transport, interface, rate, size, duration_ms)))
+    except Exception as e:
+        conn.send((False, str(e)))
+
+def resolve_flow_addresses(flows, interface, address_cache = None):
+    addresses = resolve_addresses([flow.target for flow in flows], interface, address_cache)
+    for flow in flows:
+        flow.address = addresses[flow.target]
+        if flow.address is None:
+            raise LabError('no address for {} on {}'.format(get_display_name(flow.target), interface))
+
+# distribute the flows over one process per CPU
+def start_flow_processes(flows, transport, interface, rate, size, duration_ms):
+    context = multiprocessing.get_context('fork')
+    process_count = max(1, min(common.get_cpu_count(), len(flows)))
+    processes = []
+    for i in range(0, process_count):
+        (parent_conn, child_conn) = context.Pipe()
+        process = context.Process(target=run_flows, args=(flows[i::process_count], transport, interface, rate, size, duration_ms, child_conn))
+        process.start()
+        processes.append((process, parent_conn))
+    return processes
+
+# the results of all processes are collected before an error is raised
+def wait_flow_processes(processes):
+    results = []
+    error = None
+    for (process, conn) in processes:
+        (ok, result) = (False, None)
+        # the process exits without result if it is killed
+        if conn in multiprocessing.connection.wait([conn, process.sentinel]):
+            try:
+                (ok, result) = conn.recv()
+            except EOFError:
+                pass
+        process.join()
+        if ok:
+            results.extend(result)
+        elif error is None:
+            error = result or 'exit code {}'.format(process.exitcode)
+    if error is not None:
+        raise LabError('flow process failed: {}'.format(error))
+    return results
+
+def run_traffic(nsnames, interface, transport, pattern, flow_count, rate, size, duration_ms, gateway = None, outfile = None, gateways = None, address_cache = None):
+    size = max(size, flow_header.size)
+    pairs = get_flow_pairs(nsnames, flow_count, pattern, gateway, gateways)
+    flows = [Flow(i, source, target, 5000 + i) for (i, (source, target)) in enumerate(pairs)]
+    resolve_flow_addresses(flows, interface, address_cache)
+
+    if common.verbosity != 'quiet':
+        print('{} {} flows ({}), {} packets/s per flow, {} bytes per packet, duration: {}ms'.format(
+            len(flows), transport, pattern, rate, size, duration_ms))
+
+    processes = start_flow_processes(flows, transport, interface, rate, size, duration_ms)
+    with common.tracer.span('flows', flows=len(flows)):
+        results = wait_flow_processes(processes)
+
+    if outfile is not None:
+        header = (
+            'source target '
+            'packets_send '
+            'packets_received '
+            'loss '
+            'goodput_kbits '
+            'latency_avg_ms '
+            'latency_max_ms\n'
+        )
+
+        # add csv header if not present
+        add_csv_header(outfile, header.replace(' ', common.csv_delimiter))
+
+    total_send = 0
+    total_received = 0
+    total_bytes = 0
+    for flow in sorted(results, key=lambda flow: flow.id):
+        loss = 0.0 if flow.packets_send == 0 else (100.0 - 100.0 * flow.packets_received / flow.packets_send)
+        goodput_kbits = 8.0 * flow.bytes_received / duration_ms
+        latency_avg_ms = 0.0 if flow.packets_received == 0 else (flow.latency_sum_ns / flow.packets_received / 1000000.0)
+        latency_max_ms = flow.latency_max_ns / 1000000.0
+        total_send += flow.packets_send
+        total_received += flow.packets_received
+        total_bytes += flow.bytes_received
+
+        if common.verbosity == 'verbose':
+            print('{} => {}: send: {}, received: {}, lost: {:0.2f}%, goodput: {:0.2f} kbit/s, latency: {:0.3f}ms (max {:0.3f}ms)'.format(
+                get_display_name(flow.source), get_display_name(flow.target), flow.packets_send, flow.packets_received, loss, goodput_kbits, latency_avg_ms, latency_max_ms))
+
+        if outfile is not None:
+            outfile.write('{} {} {} {} {:0.2f} {:0.2f} {:0.3f} {:0.3f}\n'.format(
+                get_display_name(flow.source), get_display_name(flow.target),
+                flow.packets_send,
+                flow.packets_received,
+                loss,
+                goodput_kbits,
+                latency_avg_ms,
+                latency_max_ms
+            ).replace(' ', common.csv_delimiter))
+
+    if common.verbosity != 'quiet':
+        print('send: {}, received: {}, lost: {:0.2f}%, goodput: {:0.2f} kbit/s'.format(
+            total_send, total_received,
+            0.0 if total_send == 0 else (100.0 - 100.0 * total_received / total_send),
+            8.0 * total_bytes / duration_ms
+        ))
+
+    return results
+
+'''
+Sample the transmit counters of all ve-<source>-<target> interfaces in
+namespace "switch" at fixed intervals. Traffic from source to target
+leaves through ve-<source>-<target>, so each interface is one direction
+of a link. Only links with traffic are written (sparse matrix).
+The mirred data plane has no such interfaces.
+'''
+def run_link_matrix(interval_ms, duration_ms, outfile = None, top = 10):
+    if get_data_plane() == 'mirred':
+        raise LabError('link statistics need the bridge data plane')
+
+    count = max(1, int(duration_ms // interval_ms))
+    totals = {}
+    previous = {}
+    start_ns = time.monotonic_ns()
+
+    if outfile is not None:
+        header = 'time_ms source target bytes_per_s packets_per_s\n'
+        add_csv_header(outfile, header.replace(' ', common.csv_delimiter))
+
+    def sample(i):
+        stats = get_workers().call(common.switch, read_link_statistics)
+        now_ns = time.monotonic_ns()
+
+        for (ifname, (tx_bytes, tx_packets)) in stats.items():
+            last = previous.get(ifname)
+            previous[ifname] = (tx_bytes, tx_packets, now_ns)
+            if last is None or tx_bytes == last[0]:
+                continue
+
+            seconds = (now_ns - last[2]) / 1000000000.0
+            bytes_per_s = (tx_bytes - last[0]) / seconds
+            packets_per_s = (tx_packets - last[1]) / seconds
+            totals[ifname] = totals.get(ifname, 0) + (tx_bytes - last[0])
+
+            if outfile is not None:
+                (source, target) = ifname[3:].split('-', 1)
+                outfile.write('{} {} {} {:0.0f} {:0.1f}\n'.format(
+                    (now_ns - start_ns) // 1000000,
+                    common.name_map.get_name(source), common.name_map.get_name(target),
+                    bytes_per_s, packets_per_s
+                ).replace(' ', common.csv_delimiter))
+
+    # one more sample for the initial counters
+    scheduler = ProbeScheduler(count + 1, (count + 1) * interval_ms)
+    with common.tracer.span('link statistics', samples=count + 1):
+        scheduler.run(sample)
+
+    if common.verbosity != 'quiet':
+        seconds = count * interval_ms / 1000.0
+        print('{} link directions with traffic, {} samples every {:g}ms'.format(len(totals), count + 1, interval_ms))
+        for (ifname, total) in sorted(totals.items(), key=lambda item: -item[1])[:top]:
+            (source, target) = ifname[3:].split('-', 1)
+            print('{} => {}: {}/s'.format(get_display_name(common.get_nsname(source)), get_display_name(common.get_nsname(target)), format_bytes(total / seconds)))
+
+    return totals
+
+'''
+Measurements from a set of namespaces, e.g.:
+  probe = Probe(nsnames, protocol.interface)
+  result = probe.run(path_count = 100, test_duration_ms = 10000)
+Results are printed (see common.verbosity), written to
+outfile as CSV and returned.
+'''
+class Probe:
+    def __init__(self, nsnames, interface = 'uplink', outfile = None, address_cache = None):
+        self.nsnames = nsnames
+        self.interface = interface
+        self.outfile = outfile
+        # nsname => address on interface, can be shared by probes
+        self.address_cache = {} if address_cache is None else address_cache
+
+    # ping random pairs, returns the summary as dict
+    def run(self, path_count = 10, test_duration_ms = 1000, wait_ms = 0, gateways = None, arrival = 'even', gateway_share = 0.8):
+        return run_test(self.nsnames, self.interface, path_count, test_duration_ms, wait_ms, self.outfile, gateways, arrival, gateway_share, self.address_cache)
+
+    # send flows between random pairs, returns the list of Flow
+    def traffic(self, transport = 'udp', pattern = 'uniform', flow_count = 10, rate = 100, size = 1000, duration_ms = 10000, gateway = None, gateways = None):
+        return run_traffic(self.nsnames, self.interface, transport, pattern, flow_count, rate, size, duration_ms, gateway, self.outfile, gateways, self.address_cache)
+
+    # bytes per link direction ("ve-<source>-<target>") over the duration
+    def links(self, interval_ms = 1000, duration_ms = 10000, top = 10):
+        return run_link_matrix(interval_ms, duration_ms, self.outfile, top)
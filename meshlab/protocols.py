@@ -0,0 +1,464 @@
+'''
+Start and stop routing protocol daemons in all namespaces.
+'''
+
+import concurrent.futures
+import subprocess
+import signal
+import select
+import json
+import time
+import os
+
+from .common import LabError, get_display_name
+from .namespaces import get_workers, read_mac_address, run_command, delete_interfaces
+from . import common
+
+
+def exec(cmd, detach=False):
+    if common.verbosity == 'verbose':
+        redirect = ''
+    elif common.verbosity == 'normal':
+        redirect = ' > /dev/null'
+    elif common.verbosity == 'quiet':
+        redirect = ' > /dev/null 2>&1'
+    else:
+        raise LabError('invalid verbosity: {}'.format(common.verbosity))
+
+    with common.tracer.command(cmd):
+        rc = os.system(cmd + redirect + (' &' if detach else ''))
+
+    if rc != 0:
+        raise LabError('command failed: {}'.format(cmd))
+
+# Set some IPv6 address (executed by a namespace worker)
+def setup_uplink_worker(interface):
+    def eui64_suffix(interface):
+        mac = read_mac_address(interface)
+        return '{:02x}{}:{}ff:fe{}:{}{}'.format(
+            int(mac[0:2], 16) ^ 2, # byte with flipped bit
+            mac[3:5], mac[6:8], mac[9:11], mac[12:14], mac[15:17]
+        )
+
+    run_command(['ip', '-batch', '-'], input=(
+        'link set "{0}" down\n'
+        'link set "{0}" up\n'
+        'address add fdef:17a0:ffb1:300:{1}/64 dev "{0}"\n'
+    ).format(interface, eui64_suffix(interface)))
+
+def setup_uplinks(nsnames, interface):
+    if common.verbosity == 'verbose':
+        print('setup {} in all namespaces'.format(interface))
+
+    with common.tracer.span('setup addresses'):
+        get_workers().map(setup_uplink_worker, nsnames, interface)
+
+# Add uplink to batman-adv and set address (executed by a namespace worker)
+def setup_batmanadv_worker():
+    run_command(['ip', '-batch', '-'], input=(
+        'link set "uplink" down\n'
+        'link set "uplink" up\n'
+    ))
+    run_command(['batctl', 'meshif', 'bat0', 'interface', 'add', 'uplink'])
+    setup_uplink_worker('bat0')
+
+# process names of the routing daemons
+daemon_names = {
+    'babel': 'babeld',
+    'olsr2': 'olsrd2',
+    'bmx6': 'bmx6',
+    'bmx7': 'bmx7',
+    'yggdrasil': 'yggdrasil'
+}
+
+def get_registry_file(protocol):
+    return common.get_state_path('{}.pids'.format(protocol))
+
+'''
+Get the ids of processes with name pname running in the given namespaces.
+/proc is only scanned once for all namespaces.
+'''
+def get_namespace_pids(nsnames, pname):
+    namespaces = {}
+    for nsname in nsnames:
+        try:
+            st = os.stat('/var/run/netns/{}'.format(nsname))
+            namespaces[(st.st_dev, st.st_ino)] = nsname
+        except OSError:
+            pass
+
+    pids = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            st = os.stat('/proc/{}/ns/net'.format(entry))
+            nsname = namespaces.get((st.st_dev, st.st_ino))
+            if nsname is None:
+                continue
+            with open('/proc/{}/comm'.format(entry)) as file:
+                if file.read().strip() != pname:
+                    continue
+            pids.setdefault(nsname, []).append(int(entry))
+        except OSError:
+            # process is gone
+            continue
+
+    return pids
+
+'''
+Remember the process ids of all started daemons.
+Daemons that fork into the background might need some time to show up.
+'''
+def register_instances(protocol, nsnames):
+    if protocol not in daemon_names:
+        return
+
+    pids = {}
+    for _ in range(0, 50):
+        pids = get_namespace_pids(nsnames, daemon_names[protocol])
+        if len(pids) == len(nsnames):
+            break
+        time.sleep(0.1)
+
+    with open(get_registry_file(protocol), 'w') as file:
+        json.dump(pids, file)
+
+    if common.verbosity == 'verbose':
+        print('registered {} {} processes'.format(sum(len(p) for p in pids.values()), daemon_names[protocol]))
+
+'''
+Kill all daemons of a protocol at once and wait for them to exit.
+Registered daemons are also found if their namespace was already removed.
+'''
+def kill_instances(protocol, nsnames, timeout_ms = 10000):
+    pname = daemon_names[protocol]
+    pids = set()
+
+    for found in get_namespace_pids(nsnames, pname).values():
+        pids.update(found)
+
+    registry_file = get_registry_file(protocol)
+    if os.path.exists(registry_file):
+        with open(registry_file) as file:
+            for found in json.load(file).values():
+                pids.update(found)
+
+    pidfds = []
+    for pid in pids:
+        try:
+            pidfd = os.pidfd_open(pid)
+            # the process id might have been reused in the meantime
+            with open('/proc/{}/comm'.format(pid)) as file:
+                if file.read().strip() != pname:
+                    os.close(pidfd)
+                    continue
+            signal.pidfd_send_signal(pidfd, signal.SIGKILL)
+            pidfds.append(pidfd)
+        except (ProcessLookupError, FileNotFoundError):
+            # process is gone
+            continue
+
+    # a pidfd becomes readable when the process has exited
+    poller = select.poll()
+    for pidfd in pidfds:
+        poller.register(pidfd, select.POLLIN)
+
+    remaining = len(pidfds)
+    deadline = time.monotonic() + timeout_ms / 1000.0
+    while remaining > 0 and time.monotonic() < deadline:
+        for (pidfd, event) in poller.poll(max(0, int((deadline - time.monotonic()) * 1000))):
+            poller.unregister(pidfd)
+            remaining -= 1
+
+    for pidfd in pidfds:
+        os.close(pidfd)
+
+    if remaining > 0:
+        raise LabError('failed to kill {} {} processes'.format(remaining, pname))
+
+    if os.path.exists(registry_file):
+        os.remove(registry_file)
+
+    if common.verbosity == 'verbose':
+        print('killed {} {} processes'.format(len(pidfds), pname))
+
+def start_none_instances(nsnames):
+    # nothing to do
+    pass
+
+def stop_none_instances(nsnames):
+    # nothing to do
+    pass
+
+def start_yggdrasil_instances(nsnames):
+    for nsname in nsnames:
+        if common.verbosity == 'verbose':
+            print('start yggdrasil on {}'.format(get_display_name(nsname)))
+
+        # Create a configuration file
+        configfile = '/tmp/yggdrasil-{}.conf'.format(nsname)
+        f = open(configfile, 'w')
+        f.write('AdminListen: none')
+        f.close()
+
+        exec('ip netns exec "{}" yggdrasil -useconffile {}'.format(nsname, configfile), True)
+
+def stop_yggdrasil_instances(nsnames):
+    if common.verbosity == 'verbose':
+       print('stop yggdrasil in all namespaces')
+
+    kill_instances('yggdrasil', nsnames)
+    exec('rm -f /tmp/yggdrasil-{}*.conf'.format(common.ns_prefix))
+
+def start_batmanadv_instances(nsnames):
+    if common.verbosity == 'verbose':
+        print('start batman-adv in all namespaces')
+
+    get_workers().map(setup_batmanadv_worker, nsnames)
+
+def stop_batmanadv_instances(nsnames):
+    if common.verbosity == 'verbose':
+        print('stop batman-adv in all namespaces')
+
+    # removing bat0 also releases the uplink
+    get_workers().map(delete_interfaces, nsnames, ['bat0'])
+
+def start_babel_instances(nsnames):
+    setup_uplinks(nsnames, 'uplink')
+
+    for nsname in nsnames:
+        if common.verbosity == 'verbose':
+            print('start babel on {}'.format(get_display_name(nsname)))
+
+        exec('ip netns exec "{}" babeld -D -I /tmp/babel-{}.pid "uplink"'.format(nsname, nsname))
+
+def stop_babel_instances(nsnames):
+    if common.verbosity == 'verbose':
+        print('stop babel in all namespaces')
+
+    kill_instances('babel', nsnames)
+    exec('rm -f /tmp/babel-{}*.pid'.format(common.ns_prefix))
+
+def start_olsr2_instances(nsnames):
+    setup_uplinks(nsnames, 'uplink')
+
+    for nsname in nsnames:
+        if common.verbosity == 'verbose':
+            print('start olsr2 on {}'.format(get_display_name(nsname)))
+
+        # Create a configuration file
+        # Print all settings: olsrd2_static --schema=all
+        configfile = '/tmp/olsrd2-{}.conf'.format(nsname)
+        f = open(configfile, 'w')
+        f.write(
+            '[global]\n'
+            'fork       yes\n'
+            'lockfile   -\n'
+            '\n'
+            # restrict to IPv6
+            '[olsrv2]\n'
+            'originator  -0.0.0.0/0\n'
+            'originator  -::1/128\n'
+            'originator  default_accept\n'
+            '\n'
+            # restrict to IPv6
+            '[interface]\n'
+            'bindto  -0.0.0.0/0\n'
+            'bindto  -::1/128\n'
+            'bindto  default_accept\n'
+            )
+        f.close()
+
+        exec('ip netns exec "{}" olsrd2 "uplink" --load {}'.format(nsname, configfile))
+
+def stop_olsr2_instances(nsnames):
+    if common.verbosity == 'verbose':
+        print('stop olsr2 in all namespaces')
+
+    kill_instances('olsr2', nsnames)
+    exec('rm -f /tmp/olsrd2-{}*.conf'.format(common.ns_prefix))
+
+def start_bmx7_instances(nsnames):
+    exec('rm -rf /tmp/bmx7_{}*'.format(common.ns_prefix))
+    setup_uplinks(nsnames, 'uplink')
+
+    for nsname in nsnames:
+        if common.verbosity == 'verbose':
+            print('start bmx7 on {}'.format(get_display_name(nsname)))
+
+        exec('ip netns exec "{}" bmx7 --runtimeDir /tmp/bmx7_{} dev=uplink'.format(nsname, nsname))
+
+def stop_bmx7_instances(nsnames):
+    if common.verbosity == 'verbose':
+        print('stop bmx7 in all namespaces')
+
+    kill_instances('bmx7', nsnames)
+    exec('rm -rf /tmp/bmx7_{}*'.format(common.ns_prefix))
+
+def start_bmx6_instances(nsnames):
+    exec('rm -rf /tmp/bmx6_{}*'.format(common.ns_prefix))
+    setup_uplinks(nsnames, 'uplink')
+
+    for nsname in nsnames:
+        if common.verbosity == 'verbose':
+            print('start bmx6 on {}'.format(get_display_name(nsname)))
+
+        exec('ip netns exec "{}" bmx6 --runtimeDir /tmp/bmx6_{} dev=uplink'.format(nsname, nsname, nsname))
+
+def stop_bmx6_instances(nsnames):
+    if common.verbosity == 'verbose':
+        print('stop bmx6 in all namespaces')
+
+    kill_instances('bmx6', nsnames)
+    exec('rm -rf /tmp/bmx6_{}*'.format(common.ns_prefix))
+
+def start_routing_protocol(protocol, nsnames):
+    if protocol == 'batman-adv':
+        start_batmanadv_instances(nsnames)
+    elif protocol == 'yggdrasil':
+        start_yggdrasil_instances(nsnames)
+    elif protocol == 'babel':
+        start_babel_instances(nsnames)
+    elif protocol == 'olsr2':
+        start_olsr2_instances(nsnames)
+    elif protocol == 'bmx6':
+        start_bmx6_instances(nsnames)
+    elif protocol == 'bmx7':
+        start_bmx7_instances(nsnames)
+    elif protocol == 'none':
+        start_none_instances(nsnames)
+    else:
+        raise LabError('unknown routing protocol: {}'.format(protocol))
+
+    register_instances(protocol, nsnames)
+
+def stop_routing_protocol(protocol, nsnames):
+    if protocol == 'batman-adv':
+        stop_batmanadv_instances(nsnames)
+    elif protocol == 'yggdrasil':
+        stop_yggdrasil_instances(nsnames)
+    elif protocol == 'babel':
+        stop_babel_instances(nsnames)
+    elif protocol == 'olsr2':
+        stop_olsr2_instances(nsnames)
+    elif protocol == 'bmx6':
+        stop_bmx6_instances(nsnames)
+    elif protocol == 'bmx7':
+        stop_bmx7_instances(nsnames)
+    elif protocol == 'none':
+        stop_none_instances(nsnames)
+    else:
+        raise LabError('unknown routing protocol: {}'.format(protocol))
+
+'''
+Check that the namespace graph built by network.py still exists:
+every node has its uplink interface and a bridge with downlink in "switch".
+Returns a list of problems.
+'''
+def verify_graph(nsnames):
+    problems = []
+
+    output = os.popen('ip -n "{}" -br link show'.format(common.switch)).read()
+    switch_ifnames = set(line.split()[0].split('@')[0] for line in output.split('\n') if len(line) > 0)
+    if len(switch_ifnames) == 0:
+        problems.append('namespace "{}" is missing'.format(common.switch))
+
+    # no bridges with the mirred data plane
+    bridges = any(ifname.startswith('br-') for ifname in switch_ifnames)
+
+    def check(nsname):
+        name = common.get_node_id(nsname)
+        found = []
+        if len(switch_ifnames) > 0:
+            for ifname in (['br-{}'.format(name)] if bridges else []) + ['dl-{}'.format(name)]:
+                if ifname not in switch_ifnames:
+                    found.append('{} is missing in namespace "{}"'.format(ifname, common.switch))
+        output = os.popen('ip -n "{}" -br link show dev uplink 2> /dev/null'.format(nsname)).read()
+        if 'uplink' not in output:
+            found.append('uplink is missing in namespace "{}"'.format(nsname))
+        return found
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
+        for found in executor.map(check, nsnames):
+            problems.extend(found)
+
+    return problems
+
+'''
+Remove all protocol state from a namespace (bat0/tun0, addresses,
+neighbor caches and routes of IPv4 and IPv6 on the uplink), but keep
+the uplink itself. Errors of the forced batch are ignored since bat0
+and tun0 usually do not exist, verify_graph checks the uplinks later.
+'''
+def reset_uplink(nsname):
+    batch = [
+        'link del bat0',
+        'link del tun0',
+        'link set uplink down',
+        'addr flush dev uplink scope global',
+        'neigh flush all',
+        # routes of the link come back with "up"
+        'route flush dev uplink table all',
+        'link set uplink up'
+    ]
+
+    subprocess.run(['ip', '-n', nsname, '-force', '-batch', '-'], input='\n'.join(batch) + '\n',
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, universal_newlines=True)
+
+def switch_routing_protocol(from_protocol, to_protocol, nsnames):
+    # batman-adv interfaces are removed by the reset, no need for one batctl call per node
+    if from_protocol != 'batman-adv':
+        stop_routing_protocol(from_protocol, nsnames)
+
+    if common.verbosity == 'verbose':
+        print('reset uplinks in all namespaces')
+
+    with common.tracer.span('reset uplinks'), concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(reset_uplink, nsnames))
+
+    with common.tracer.span('verify graph'):
+        problems = verify_graph(nsnames)
+    if len(problems) > 0:
+        raise LabError('network is not intact:\n{}'.format('\n'.join(problems)))
+
+    start_routing_protocol(to_protocol, nsnames)
+
+# protocols that can be started by Protocol
+protocols = ['none', 'babel', 'batman-adv', 'olsr2', 'bmx6', 'bmx7', 'yggdrasil']
+
+'''
+A routing protocol running in a set of namespaces, e.g.:
+  protocol = Protocol('babel')
+  protocol.start(nsnames)
+  ...
+  protocol = protocol.switch('bmx7', nsnames)
+'''
+class Protocol:
+    def __init__(self, name):
+        if name not in protocols:
+            raise ValueError('unknown routing protocol: {}'.format(name))
+        self.name = name
+
+        # network interface to send packets to/from,
+        # batman-adv and yggdrasil use their own interface as entry point to the mesh
+        self.interface = 'uplink'
+        if name == 'batman-adv':
+            self.interface = 'bat0'
+        elif name == 'yggdrasil':
+            self.interface = 'tun0'
+
+    def start(self, nsnames):
+        with common.tracer.span('start daemons', protocol=self.name):
+            start_routing_protocol(self.name, nsnames)
+
+    def stop(self, nsnames):
+        with common.tracer.span('stop daemons', protocol=self.name):
+            stop_routing_protocol(self.name, nsnames)
+
+    # stop this protocol and start another one without rebuilding the network
+    def switch(self, to_name, nsnames):
+        to_protocol = Protocol(to_name)
+        with common.tracer.span('switch protocol', protocol=to_name):
+            switch_routing_protocol(self.name, to_name, nsnames)
+        return to_protocol
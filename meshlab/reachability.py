@@ -0,0 +1,216 @@
+'''
+Reachability between all pairs of a set of source and target nodes.
+Every source namespace sends ICMPv6 echo requests to all targets over
+one raw socket, the sockets of many sources are served by one process.
+The send rate is paced over all processes.
+'''
+
+import multiprocessing.connection
+import multiprocessing
+import selectors
+import resource
+import json
+import time
+import os
+
+from .common import LabError, get_display_name, add_csv_header
+from .namespaces import setns
+from .probes import ICMP6_ECHO_REQUEST, ICMP6_ECHO_REPLY, echo_header, get_echo_socket, resolve_addresses, get_sockaddr
+from . import common
+
+
+class Row:
+    def __init__(self, index, nsname, targets):
+        self.index = index
+        self.nsname = nsname
+        # list of (target index, address)
+        self.targets = targets
+        self.identifier = 0
+        self.sock = None
+        self.sockaddrs = {}
+
+'''
+Send count echo requests from every row to all of its targets at the
+given rate. Targets are sent to in a different order by every row, so
+not all sources probe the same target at once. Returns (row index => list
+of minimum RTT in ns per target, None if no reply) via conn.
+'''
+def run_echo_rows(rows, interface, rate, count, timeout_ms, conn):
+    # one socket per row
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, len(rows) + 64)), hard))
+
+    selector = selectors.DefaultSelector()
+    for row in rows:
+        setns(row.nsname)
+        row.sock = get_echo_socket()
+        row.identifier = (os.getpid() + row.index) & 0xffff
+        for (target, address) in row.targets:
+            if address is not None:
+                row.sockaddrs[target] = get_sockaddr(address, 0, interface)
+        selector.register(row.sock, selectors.EVENT_READ, row)
+
+    # (row, target), every target of a row once per round
+    order = []
+    for attempt in range(0, count):
+        for r in range(0, max([0] + [len(row.targets) for row in rows])):
+            for row in rows:
+                if r < len(row.targets):
+                    order.append((attempt, row, row.targets[(r + row.index) % len(row.targets)][0]))
+
+    rtts = {row.index: {} for row in rows}
+    interval_ns = 1000000000.0 / rate
+    start_ns = time.monotonic_ns()
+    sent = 0
+    end_ns = None
+
+    while True:
+        now_ns = time.monotonic_ns()
+        if end_ns is not None and now_ns >= end_ns:
+            break
+
+        # send all due requests at once
+        due = min(len(order), int((now_ns - start_ns) / interval_ns) + 1)
+        while sent < due:
+            (attempt, row, target) = order[sent]
+            sent += 1
+            sockaddr = row.sockaddrs.get(target)
+            if sockaddr is None:
+                continue
+            try:
+                row.sock.sendto(echo_header.pack(ICMP6_ECHO_REQUEST, 0, 0, row.identifier, attempt, time.monotonic_ns(), target), sockaddr)
+            except OSError:
+                # no route or send buffer full => no reply
+                pass
+
+        if sent == len(order) and end_ns is None:
+            end_ns = now_ns + timeout_ms * 1000000
+
+        if end_ns is not None:
+            timeout_ns = end_ns - now_ns
+        else:
+            timeout_ns = start_ns + int(sent * interval_ns) - now_ns
+
+        for (key, _) in selector.select(max(0, timeout_ns) / 1000000000.0):
+            row = key.data
+            while True:
+                try:
+                    data = row.sock.recv(1024)
+                except BlockingIOError:
+                    break
+                received_ns = time.monotonic_ns()
+                if len(data) < echo_header.size:
+                    continue
+                (kind, _, _, identifier, _, send_ns, target) = echo_header.unpack_from(data)
+                if kind != ICMP6_ECHO_REPLY or identifier != row.identifier or target not in row.sockaddrs:
+                    continue
+                rtt_ns = received_ns - send_ns
+                known = rtts[row.index].get(target)
+                if known is None or rtt_ns < known:
+                    rtts[row.index][target] = rtt_ns
+
+    for row in rows:
+        row.sock.close()
+
+    conn.send(rtts)
+
+'''
+Write the matrix as JSON: one hex bitmap (bit j of row i is set if
+target j answered source i) and one list of RTTs in microseconds
+(0 = no reply) per source.
+'''
+def write_matrix(path, sources, targets, rtts):
+    bitmaps = []
+    rtt_rows = []
+    for i in range(0, len(sources)):
+        bits = 0
+        row = []
+        for j in range(0, len(targets)):
+            rtt_ns = rtts[i].get(j)
+            if rtt_ns is not None:
+                bits |= 1 << j
+            row.append(0 if rtt_ns is None else max(1, rtt_ns // 1000))
+        bitmaps.append('{:x}'.format(bits))
+        rtt_rows.append(row)
+
+    with open(path, 'w') as file:
+        file.write('{{"sources":{},"targets":{},\n"bitmaps":{},\n"rtt_us":[\n'.format(
+            json.dumps([get_display_name(nsname)[3:] for nsname in sources]),
+            json.dumps([get_display_name(nsname)[3:] for nsname in targets]),
+            json.dumps(bitmaps)))
+        file.write(',\n'.join(json.dumps(row, separators=(',', ':')) for row in rtt_rows))
+        file.write('\n]}\n')
+
+'''
+Measure the reachability of all targets from all sources
+(without a node to itself) with count echo requests per pair.
+'''
+def run_reachability(sources, targets, interface, rate, count, timeout_ms, matrix_path = None, outfile = None, address_cache = None):
+    addresses = resolve_addresses(targets, interface, address_cache)
+
+    rows = []
+    pairs = 0
+    for (i, source) in enumerate(sources):
+        row_targets = [(j, addresses[target]) for (j, target) in enumerate(targets) if target != source]
+        rows.append(Row(i, source, row_targets))
+        pairs += len(row_targets)
+
+    if common.verbosity != 'quiet':
+        print('{} sources, {} targets, {} pairs, {} requests per pair, {} requests/s'.format(
+            len(sources), len(targets), pairs, count, rate))
+
+    # distribute the rows over one process per CPU, each sends with an equal share of the rate
+    context = multiprocessing.get_context('fork')
+    process_count = max(1, min(common.get_cpu_count(), len(rows)))
+    processes = []
+    start_ms = time.monotonic_ns() // 1000000
+    for i in range(0, process_count):
+        (parent_conn, child_conn) = context.Pipe()
+        process = context.Process(target=run_echo_rows, args=(rows[i::process_count], interface, rate / process_count, count, timeout_ms, child_conn))
+        process.start()
+        processes.append((process, parent_conn))
+
+    rtts = {}
+    with common.tracer.span('reachability', pairs=pairs):
+        for (process, conn) in processes:
+            if conn not in multiprocessing.connection.wait([conn, process.sentinel]):
+                raise LabError('reachability probing failed')
+            rtts.update(conn.recv())
+            process.join()
+    duration_ms = time.monotonic_ns() // 1000000 - start_ms
+
+    reachable = sum(len(found) for found in rtts.values())
+    rtt_values = sorted(rtt_ns for found in rtts.values() for rtt_ns in found.values())
+    rtt_avg_ms = 0.0 if reachable == 0 else (sum(rtt_values) / reachable / 1000000.0)
+    rtt_max_ms = 0.0 if reachable == 0 else (rtt_values[-1] / 1000000.0)
+    share = 0.0 if pairs == 0 else (100.0 * reachable / pairs)
+
+    if matrix_path is not None:
+        write_matrix(matrix_path, sources, targets, rtts)
+
+    if outfile is not None:
+        header = 'node_count sources targets pairs reachable rtt_avg_ms rtt_max_ms duration_ms\n'
+        add_csv_header(outfile, header.replace(' ', common.csv_delimiter))
+        outfile.write('{} {} {} {} {} {:0.3f} {:0.3f} {}\n'.format(
+            len(set(sources) | set(targets)), len(sources), len(targets), pairs, reachable, rtt_avg_ms, rtt_max_ms, duration_ms
+        ).replace(' ', common.csv_delimiter))
+
+    if common.verbosity != 'quiet':
+        print('reachable: {} of {} pairs ({:0.2f}%), rtt avg: {:0.3f}ms, max: {:0.3f}ms, duration: {}ms'.format(
+            reachable, pairs, share, rtt_avg_ms, rtt_max_ms, duration_ms))
+
+    if common.verbosity == 'verbose':
+        # sources and targets with the most unreachable pairs
+        unreachable_rows = {}
+        unreachable_columns = {}
+        for row in rows:
+            for (j, _) in row.targets:
+                if j not in rtts[row.index]:
+                    unreachable_rows[row.nsname] = unreachable_rows.get(row.nsname, 0) + 1
+                    unreachable_columns[targets[j]] = unreachable_columns.get(targets[j], 0) + 1
+        for (nsname, missing) in sorted(unreachable_rows.items(), key=lambda item: -item[1])[:10]:
+            print('from {}: {} unreachable'.format(get_display_name(nsname), missing))
+        for (nsname, missing) in sorted(unreachable_columns.items(), key=lambda item: -item[1])[:10]:
+            print('to {}: {} unreachable'.format(get_display_name(nsname), missing))
+
+    return (reachable, pairs, rtts)
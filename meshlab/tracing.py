@@ -0,0 +1,114 @@
+'''
+Timing spans for phases and commands of network.py and tests.py.
+
+Spans are exported as Chrome trace JSON (chrome://tracing, ui.perfetto.dev)
+and summarized per operation as a table of count, total and percentiles.
+When tracing is disabled, span() returns a shared no-op object.
+'''
+
+import threading
+import atexit
+import json
+import math
+import time
+import os
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+no_span = NoSpan()
+
+class Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_ns = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.category, self.start_ns, time.monotonic_ns(), self.args)
+        return False
+
+'''
+Get the operation type of a shell command, e.g.
+'ip netns exec "switch" ip link add name "br-a" type bridge' => 'ip link add'
+'tc -n "switch" -batch -' => 'tc -batch'
+'''
+def get_operation(cmd):
+    words = cmd.split()
+    if words[:3] == ['ip', 'netns', 'exec']:
+        words = words[4:]
+    if '-batch' in words:
+        return words[0] + ' -batch'
+    operation = []
+    for word in words:
+        if len(operation) == 3 or word.startswith('"') or word.startswith('-') or word in ('|', '||', '&&'):
+            break
+        operation.append(word)
+    return ' '.join(operation)
+
+class Tracer:
+    def __init__(self, path = None, commands = False):
+        self.path = path
+        self.enabled = path is not None
+        self.commands = self.enabled and commands
+        self.events = []
+        self.pid = os.getpid()
+        if self.enabled:
+            # also write the trace if the program aborts
+            atexit.register(self.write)
+
+    def span(self, name, category = 'phase', **args):
+        if not self.enabled:
+            return no_span
+        return Span(self, name, category, args)
+
+    # span of a shell command, only if commands are traced
+    def command(self, cmd):
+        if not self.commands:
+            return no_span
+        return Span(self, get_operation(cmd), 'command', {'cmd': cmd})
+
+    def add(self, name, category, start_ns, end_ns, args):
+        # list.append is atomic, spans can come from multiple threads
+        self.events.append((name, category, start_ns, end_ns, threading.get_ident(), args))
+
+    def write(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+
+        trace_events = []
+        for (name, category, start_ns, end_ns, tid, args) in self.events:
+            trace_events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': start_ns / 1000.0, 'dur': (end_ns - start_ns) / 1000.0, 'args': args})
+
+        with open(self.path, 'w') as file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file)
+
+        self.print_summary()
+
+    def print_summary(self):
+        durations = {}
+        for (name, category, start_ns, end_ns, tid, args) in self.events:
+            durations.setdefault((category, name), []).append((end_ns - start_ns) / 1000000.0)
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(math.ceil(len(values) * p / 100.0)) - 1)]
+
+        print('{:<8} {:<32} {:>7} {:>11} {:>9} {:>9} {:>9} {:>9}'.format('category', 'operation', 'count', 'total ms', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+        # most expensive operations first
+        for ((category, name), values) in sorted(durations.items(), key=lambda item: -math.fsum(item[1])):
+            values.sort()
+            print('{:<8} {:<32} {:>7} {:>11.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                category, name[:32], len(values), math.fsum(values),
+                percentile(values, 50), percentile(values, 90), percentile(values, 99), values[-1]))
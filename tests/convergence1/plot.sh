@@ -13,12 +13,12 @@ for dataid in 'line' 'rtree' 'lattice4'; do
 		set termoption lw 3;									\
 		set yrange [-5:105];									\
 		plot													\
-		'convergence-none-$dataid.tsv' using (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'none',				\
-		'convergence-batman-adv-$dataid.tsv' using (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'batman-adv',	\
-		'convergence-babel-$dataid.tsv' using (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'babel',			\
-		'convergence-yggdrasil-$dataid.tsv' (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'yggdrasil',	\
-		'convergence-olsr2-$dataid.tsv' using (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'olsr2',			\
-		'convergence-bmx6-$dataid.tsv' using (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'bmx6',				\
-		'convergence-bmx7-$dataid.tsv' using (column('node_count')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'bmx7';				\
+		'convergence-none-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'none',				\
+		'convergence-batman-adv-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'batman-adv',	\
+		'convergence-babel-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'babel',			\
+		'convergence-yggdrasil-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'yggdrasil',	\
+		'convergence-olsr2-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'olsr2',			\
+		'convergence-bmx6-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'bmx6',				\
+		'convergence-bmx7-$dataid.tsv' using (column('offset')):(100 * column('packets_received') / column('packets_send')) with linespoints title 'bmx7';				\
 	"
 done
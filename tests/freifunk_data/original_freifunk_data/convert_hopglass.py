@@ -2,16 +2,22 @@
 
 from pathlib import Path
 import argparse
+import tc_model
 import json
 import sys
+import re
 import os
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("input", help="Input meshviewer file.")
 parser.add_argument('--formatted', action="store_true", help="Formatted JSON output data.")
+parser.add_argument('--gateway-regex', help="Mark nodes as gateway if the hostname matches this regular expression, e.g. 'gateway|^gw'. The hopglass data has no gateway flag.")
+tc_model.add_arguments(parser)
 args = parser.parse_args()
 
+model = tc_model.TcModel(args)
+
 links = {}
 
 # map to give each node a short number
@@ -20,17 +26,20 @@ nodes = {}
 with open(args.input, "r") as file:
 	obj = json.load(file)
 
+	def is_gateway(name):
+		return args.gateway_regex is not None and re.search(args.gateway_regex, name) is not None
+
 	# record all nodes
 	for node in obj['JSON']['rows']:
 		if node['id'] not in nodes:
-			nodes[node['id']] = {'id': len(nodes), 'label': node['id']}
+			nodes[node['id']] = {'id': str(len(nodes)), 'name': node['id'], 'gateway': is_gateway(node['id'])}
 
 		if 'links' not in node['value']:
 			continue
 
 		for lnode in node['value']['links']:
 			if lnode['id'] not in nodes:
-				nodes[lnode['id']] = {'id': str(len(nodes)), 'name': lnode['id']}
+				nodes[lnode['id']] = {'id': str(len(nodes)), 'name': lnode['id'], 'gateway': is_gateway(lnode['id'])}
 
 	for node in obj['JSON']['rows']:
 		source = node['id']
@@ -48,6 +57,15 @@ with open(args.input, "r") as file:
 			if link_id not in links:
 				links[link_id] = {'source': nodes[source]['id'], 'target': nodes[target]['id']}
 
+				# OLSR link quality (LQ) is measured on the receiving side,
+				# the neighbor link quality (NLQ) on the sending side
+				olsr = lnode.get('olsr_ipv4', lnode.get('olsr_ipv6'))
+				if olsr is not None:
+					links[link_id]['source_tq'] = olsr['neighborLinkQuality']
+					links[link_id]['target_tq'] = olsr['linkQuality']
+
+				model.apply(links[link_id])
+
 if args.formatted:
 	json.dump({'nodes': list(nodes.values()), 'links': list(links.values())}, sys.stdout, indent="  ", sort_keys = True)
 else:
@@ -2,6 +2,7 @@
 
 from pathlib import Path
 import argparse
+import tc_model
 import json
 import sys
 import os
@@ -10,8 +11,11 @@ import os
 parser = argparse.ArgumentParser()
 parser.add_argument("input", help="Input meshviewer file.")
 parser.add_argument('--formatted', action="store_true", help="Formatted JSON output data.")
+tc_model.add_arguments(parser)
 args = parser.parse_args()
 
+model = tc_model.TcModel(args)
+
 links = []
 
 # map to give each node a short number
@@ -21,7 +25,7 @@ with open(args.input, "r") as file:
 	obj = json.load(file)
 
 	for node in obj['nodes']:
-		nodes[node['node_id']] = {'id': str(len(nodes)), 'name': node['hostname']}
+		nodes[node['node_id']] = {'id': str(len(nodes)), 'name': node['hostname'], 'gateway': node.get('is_gateway', False)}
 
 	for link in obj['links']:
 		source = link['source']
@@ -29,8 +33,9 @@ with open(args.input, "r") as file:
 		source_tq = link['source_tq']
 		target_tq = link['target_tq']
 
-		# TODO: set source_tc and target_tc
-		links.append({'source': nodes[source]['id'], 'target': nodes[target]['id']})
+		link = {'source': nodes[source]['id'], 'target': nodes[target]['id'], 'source_tq': source_tq, 'target_tq': target_tq}
+		model.apply(link)
+		links.append(link)
 
 if args.formatted:
 	json.dump({'nodes': list(nodes.values()), 'links': links}, sys.stdout, indent="  ", sort_keys = True)
@@ -0,0 +1,45 @@
+'''
+Map link quality values (TQ, 0 to 1) to traffic control
+specifications for source_tc/target_tc of network.py.
+'''
+
+def add_arguments(parser):
+	parser.add_argument('--tc-model', choices=['none', 'linear'], default='none', help='Set source_tc/target_tc from the link quality. linear: netem loss of (1 - tq) * 100%%. Default: none')
+	parser.add_argument('--loss-precision', type=int, default=0, help='Decimal places of the loss percentage. Fewer places result in fewer distinct tc specifications. Default: 0')
+	parser.add_argument('--max-loss', type=float, default=100.0, help='Upper limit for the loss percentage, e.g. to keep links with a TQ of 0 usable. Default: 100')
+	parser.add_argument('--delay', help='Add "delay <value>" to each netem specification, e.g. "10ms" or "10ms 2ms".')
+	parser.add_argument('--rate', help='Add "rate <value>" to each netem specification, e.g. "10mbit".')
+
+class TcModel:
+	def __init__(self, args):
+		self.model = args.tc_model
+		self.precision = args.loss_precision
+		self.max_loss = args.max_loss
+		self.delay = args.delay
+		self.rate = args.rate
+		# reuse identical specifications
+		self.specs = {}
+
+	def get_tc(self, tq):
+		if self.model == 'none' or tq is None:
+			return None
+
+		loss = round(min(self.max_loss, max(0.0, 100.0 * (1.0 - tq))), self.precision)
+		spec = self.specs.get(loss)
+		if spec is None:
+			spec = 'netem loss {}%'.format('{:f}'.format(loss).rstrip('0').rstrip('.'))
+			if self.delay is not None:
+				spec += ' delay {}'.format(self.delay)
+			if self.rate is not None:
+				spec += ' rate {}'.format(self.rate)
+			self.specs[loss] = spec
+		return spec
+
+	# set source_tc/target_tc of a link from source_tq/target_tq
+	def apply(self, link):
+		source_tc = self.get_tc(link.get('source_tq'))
+		target_tc = self.get_tc(link.get('target_tq'))
+		if source_tc is not None:
+			link['source_tc'] = source_tc
+		if target_tc is not None:
+			link['target_tc'] = target_tc
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import subprocess
+import argparse
+import datetime
+import tempfile
+import platform
+import json
+import math
+import time
+import sys
+import os
+
+
+parser = argparse.ArgumentParser(
+	description='Benchmark the tooling itself: build, change and clear networks of the bundled data sets at increasing sizes with protocol "none", measure traffic statistics, address lookups, kernel memory and one hop latency per data plane, and fit the scaling curve.')
+parser.add_argument('--datasets', nargs='+', default=['line', 'rtree', 'lattice4'], help='Data sets in tests/<name>_data. Default: line rtree lattice4')
+parser.add_argument('--sizes', nargs='+', type=int, default=[50, 100, 200, 400], help='Node counts, the data set file with the nearest node count is used. Default: 50 100 200 400')
+parser.add_argument('--runs', type=int, default=1, help='Number of repetitions.')
+parser.add_argument('--data-planes', nargs='+', choices=['bridge', 'mirred'], default=['bridge'], help='Data planes of network.py to compare. Default: bridge')
+parser.add_argument('--samples', type=int, default=100, help='Number of address lookups (ping targets) per measurement.')
+parser.add_argument('--latency-sources', type=int, default=10, help='Number of nodes that send echo requests to all others for the latency measurement. Default: 10')
+parser.add_argument('--output', default='benchmark.json', help='Result file. Default: benchmark.json')
+parser.add_argument('--baseline', help='Compare with the results of an earlier run.')
+parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown against the baseline that counts as regression. Default: 0.2')
+parser.add_argument('--timeout', type=int, default=3600, help='Timeout in seconds for every command.')
+
+args = parser.parse_args()
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+tests_dir = os.path.join(base_dir, '..')
+network_py = os.path.join(base_dir, '..', '..', 'network.py')
+tests_py = os.path.join(base_dir, '..', '..', 'tests.py')
+
+# operations taken from the trace of "tests.py none test"
+trace_operations = {'traffic statistics': 'statistics', 'resolve addresses': 'lookup'}
+
+# unit of the operations that are not measured in seconds
+units = {'memory': 'MB'}
+
+'''
+Get the data set files with node counts nearest to the requested sizes,
+file names are like "lattice4-0100.json".
+'''
+def get_files(dataset, sizes):
+	directory = os.path.join(tests_dir, '{}_data'.format(dataset))
+	available = {}
+	for name in os.listdir(directory):
+		if name.startswith(dataset + '-') and name.endswith('.json'):
+			available[int(name[len(dataset) + 1:-len('.json')])] = os.path.join(directory, name)
+
+	if len(available) == 0:
+		print('No data set files found in {}'.format(directory))
+		exit(1)
+
+	files = {}
+	for size in sizes:
+		nearest = min(available, key=lambda n: abs(n - size))
+		files[nearest] = available[nearest]
+	return sorted(files.items())
+
+def run(command):
+	start = time.monotonic()
+	process = subprocess.run(command, stdout=subprocess.DEVNULL, timeout=args.timeout)
+	duration = time.monotonic() - start
+	if process.returncode != 0:
+		print('Command failed: {}'.format(' '.join(command)))
+		subprocess.run([network_py, 'clear'])
+		exit(1)
+	return duration
+
+# available memory in MB, kernel memory used by namespaces and devices lowers it
+def get_available_memory():
+	with open('/proc/meminfo') as file:
+		for line in file:
+			if line.startswith('MemAvailable:'):
+				return int(line.split()[1]) / 1024.0
+	return 0.0
+
+'''
+Average RTT of echo requests from a few nodes to all others. With
+protocol "none", only neighbours are reachable, so this is the one hop
+latency of the data plane.
+'''
+def measure_latency(path):
+	with open(path) as file:
+		links = json.load(file)['links']
+	sources = []
+	for link in links:
+		for node in (str(link['source']), str(link['target'])):
+			if node not in sources and len(sources) < args.latency_sources:
+				sources.append(node)
+
+	with tempfile.NamedTemporaryFile(mode='r', suffix='.tsv') as csv:
+		run([tests_py, '--verbosity', 'quiet', '--csv-out', csv.name, 'none', 'reachability', '--count', '3', '--sources'] + sources)
+		(header, values) = csv.read().split('\n')[:2]
+	row = dict(zip(header.split('\t'), values.split('\t')))
+	return float(row['rtt_avg_ms']) / 1000.0
+
+# run a ping test and get the durations of the traced phases
+def measure_test():
+	with tempfile.NamedTemporaryFile(suffix='.json') as trace:
+		run([tests_py, '--verbosity', 'quiet', '--trace', trace.name, 'none', 'test', '--samples', str(args.samples)])
+		events = json.load(open(trace.name))['traceEvents']
+
+	durations = {}
+	for event in events:
+		operation = trace_operations.get(event['name'])
+		if operation is not None:
+			durations.setdefault(operation, []).append(event['dur'] / 1000000.0)
+	return durations
+
+'''
+Build every size twice: from the previous size (incremental)
+and from scratch after a clear of the same network.
+'''
+def benchmark_dataset(dataset, data_plane, results):
+	previous = None
+	for (nodes, path) in get_files(dataset, args.sizes):
+		print('{} {} nodes ({})'.format(dataset, nodes, data_plane))
+		sys.stdout.flush()
+
+		times = {}
+		if previous is None:
+			run([network_py, 'clear'])
+			run([network_py, '--data-plane', data_plane, 'change', 'none', path])
+		else:
+			times['incremental'] = [run([network_py, 'change', previous, path])]
+
+		times['clear'] = [run([network_py, 'clear'])]
+		available = get_available_memory()
+		times['change'] = [run([network_py, '--data-plane', data_plane, 'change', 'none', path])]
+		times['memory'] = [max(0.0, available - get_available_memory())]
+		times.update(measure_test())
+		times['latency'] = [measure_latency(path)]
+		previous = path
+
+		for (operation, values) in times.items():
+			key = (dataset, data_plane, nodes, operation)
+			results.setdefault(key, []).extend(values)
+
+	run([network_py, 'clear'])
+
+def median(values):
+	values = sorted(values)
+	n = len(values)
+	return values[n // 2] if (n % 2) == 1 else (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+'''
+Least squares fit of value = a * nodes ^ b on a log-log scale.
+'''
+def fit_power_law(points):
+	if len(points) < 2:
+		return None
+	xs = [math.log(n) for (n, t) in points]
+	ys = [math.log(max(t, 1e-9)) for (n, t) in points]
+	mx = math.fsum(xs) / len(xs)
+	my = math.fsum(ys) / len(ys)
+	sxx = math.fsum((x - mx) ** 2 for x in xs)
+	if sxx == 0:
+		return None
+	b = math.fsum((x - mx) * (y - my) for (x, y) in zip(xs, ys)) / sxx
+	a = math.exp(my - b * mx)
+	return {'a': a, 'b': b}
+
+# data set and data plane, e.g. "line" or "line/mirred"
+def get_label(dataset, data_plane):
+	return dataset if data_plane == 'bridge' else '{}/{}'.format(dataset, data_plane)
+
+def get_fits(entries):
+	points = {}
+	for entry in entries:
+		label = get_label(entry['dataset'], entry['data_plane'])
+		points.setdefault((label, entry['operation']), []).append((entry['nodes'], entry['median']))
+
+	fits = {}
+	for ((label, operation), values) in sorted(points.items()):
+		fit = fit_power_law(values)
+		if fit is not None:
+			fits.setdefault(label, {})[operation] = fit
+	return fits
+
+def compare(entries, baseline_path):
+	with open(baseline_path) as file:
+		# results of older runs have no data plane
+		baseline = {(e['dataset'], e.get('data_plane', 'bridge'), e['nodes'], e['operation']): e['median'] for e in json.load(file)['results']}
+
+	print('{:<17} {:>6} {:<12} {:>12} {:>12} {:>8}'.format('dataset', 'nodes', 'operation', 'baseline', 'current', 'change'))
+	regressions = 0
+	for entry in entries:
+		base = baseline.get((entry['dataset'], entry['data_plane'], entry['nodes'], entry['operation']))
+		if base is None or base <= 0:
+			continue
+		ratio = entry['median'] / base
+		regression = ratio > (1.0 + args.threshold)
+		if regression:
+			regressions += 1
+		unit = units.get(entry['operation'], 's')
+		print('{:<17} {:>6} {:<12} {:>10.4f}{:<2} {:>10.4f}{:<2} {:>+7.1f}%{}'.format(
+			get_label(entry['dataset'], entry['data_plane']), entry['nodes'], entry['operation'], base, unit, entry['median'], unit,
+			100.0 * (ratio - 1.0), '  REGRESSION' if regression else ''))
+	return regressions
+
+
+if os.popen('id -u').read().strip() != '0':
+	print('Need to run as root.')
+	exit(1)
+
+results = {}
+for _ in range(0, args.runs):
+	for dataset in args.datasets:
+		for data_plane in args.data_planes:
+			benchmark_dataset(dataset, data_plane, results)
+
+entries = []
+for ((dataset, data_plane, nodes, operation), values) in sorted(results.items()):
+	entries.append({'dataset': dataset, 'data_plane': data_plane, 'nodes': nodes, 'operation': operation,
+		'unit': units.get(operation, 's'), 'values': [round(v, 6) for v in values], 'median': round(median(values), 6)})
+
+fits = get_fits(entries)
+
+with open(args.output, 'w') as file:
+	json.dump({
+		'created': datetime.datetime.now().isoformat(timespec='seconds'),
+		'host': platform.node(),
+		'kernel': platform.release(),
+		'samples': args.samples,
+		'results': entries,
+		'fits': fits
+	}, file, indent=1)
+
+print('scaling (value = a * nodes ^ b):')
+for (label, operations) in fits.items():
+	for (operation, fit) in operations.items():
+		print('  {:<17} {:<12} a = {:.3g}, b = {:.2f}'.format(label, operation, fit['a'], fit['b']))
+
+if args.baseline is not None:
+	if compare(entries, args.baseline) > 0:
+		exit(1)
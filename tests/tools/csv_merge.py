@@ -1,71 +1,110 @@
 #!/usr/bin/env python3
 
 import argparse
-import time
-import json
 import math
-import sys
-import os
 import csv
 
 
 parser = argparse.ArgumentParser(
-    description='Read a CSV file and combine <span> rows. For each selected column, an extra variance column is added. Other numerical columns are replaced by the mean.')
+    description='Read a CSV file and combine rows, either <span> consecutive rows or all rows with the same group key. For each selected column, extra statistics columns are added. Other numerical columns are replaced by the mean.')
 parser.add_argument('input', help='Input CSV file')
 parser.add_argument('output', help='Output CSV file')
-parser.add_argument('--span', type=int, required=True, help='Amount of consecutive rows to be combined into a mean value.')
-parser.add_argument('--column', nargs='+', required=True, help='Calculate a standard deviation from this column and add it to the next column. Column numbering starts at 1. If a header title is present, the new columns name will be suffixed with "_sd".')
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument('--span', type=int, help='Amount of consecutive rows to be combined into a mean value.')
+group.add_argument('--group-by', nargs='+', help='Combine all rows with the same values in these columns (e.g. protocol node_count). Column numbering starts at 1.')
+parser.add_argument('--column', nargs='+', required=True, help='Calculate statistics from this column and add them as next columns. Column numbering starts at 1. If a header title is present, the new columns name will be suffixed with the statistic name, e.g. "_sd".')
+parser.add_argument('--stats', nargs='+', default=['sd'], help='Statistics to add for each selected column: sd, median, min, max, p<N> (percentile, e.g. p90) and ci<N> (half width of the confidence interval of the mean, e.g. ci95). Default: sd')
 
 args = parser.parse_args()
 
+# two-sided t-distribution critical values for 1 to 30 degrees of freedom
+t_table = {
+	90: [6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812,
+		1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729, 1.725,
+		1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697],
+	95: [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+		2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+		2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042],
+	99: [63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169,
+		3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878, 2.861, 2.845,
+		2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750],
+}
+
+# normal distribution critical values for larger samples
+z_table = {90: 1.645, 95: 1.960, 99: 2.576}
+
 def is_float(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
+	try:
+		float(s)
+		return True
+	except ValueError:
+		return False
 
 def is_int(s):
-    try:
-        int(s)
-        return True
-    except ValueError:
-        return False
+	try:
+		int(s)
+		return True
+	except ValueError:
+		return False
 
 def calc_mean(values):
-	return sum(values) / len(values)
+	return math.fsum(values) / len(values)
 
 def calc_standard_deviation(values):
+	if len(values) < 2:
+		return 0.0
 	mean = calc_mean(values)
-	d = []
-	for value in values:
-		d.append((value - mean) * (value - mean))
-	return math.sqrt((1.0 / (len(d) - 1)) * sum(d))
-
-def get_row_list(lines, col):
-	row = []
-	for line in lines:
-		row.append(float(line[col]))
-	return row
+	return math.sqrt(math.fsum((value - mean) ** 2 for value in values) / (len(values) - 1))
+
+# values need to be sorted
+def calc_percentile(values, p):
+	pos = (len(values) - 1) * p / 100.0
+	lower = math.floor(pos)
+	upper = math.ceil(pos)
+	return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+def calc_confidence(values, level):
+	n = len(values)
+	if n < 2:
+		return 0.0
+	df = n - 1
+	t = t_table[level][df - 1] if df <= 30 else z_table[level]
+	return t * calc_standard_deviation(values) / math.sqrt(n)
+
+def calc_stat(stat, values):
+	if stat == 'sd':
+		return calc_standard_deviation(values)
+	if stat == 'median':
+		return calc_percentile(values, 50)
+	if stat == 'min':
+		return values[0]
+	if stat == 'max':
+		return values[-1]
+	if stat.startswith('p'):
+		return calc_percentile(values, float(stat[1:]))
+	if stat.startswith('ci'):
+		return calc_confidence(values, int(stat[2:]))
+
+def check_stats(stats):
+	for stat in stats:
+		if stat in ('sd', 'median', 'min', 'max'):
+			continue
+		if stat.startswith('p') and is_float(stat[1:]) and 0 <= float(stat[1:]) <= 100:
+			continue
+		if stat.startswith('ci') and is_int(stat[2:]) and int(stat[2:]) in t_table:
+			continue
+		print('Invalid statistic: {} (confidence levels: {})'.format(stat, ', '.join(map(str, t_table))))
+		exit(1)
 
 '''
-Get the maximum number of used decimal places, e.g.:
+Get the number of used decimal places, e.g.:
 1 => 0
 1.0 => 1
-1.2, 1.23, 1.001 => 3
-1.234 => 3
+1.23 => 2
 '''
-def get_decimal_places(lines, col):
-	def get_places(s):
-		pos = s.find('.')
-		return 0 if pos < 0 else (len(s) - pos - 1)
-
-	max_places = 0
-	for line in lines:
-		places = get_places(line[col])
-		max_places = max(max_places, places)
-
-	return max_places
+def get_places(s):
+	pos = s.find('.')
+	return 0 if pos < 0 else (len(s) - pos - 1)
 
 '''
 Round a value to the given decimal places, e.g.:
@@ -76,94 +115,118 @@ Round a value to the given decimal places, e.g.:
 def format_float(value, places):
 	return str(round(value, places)).rstrip('0').rstrip('.')
 
-def handle_rows(rows, columns):
-	output_row = []
-	for col in range(0, len(rows[0])):
-		if (col + 1) in columns:
-			values = get_row_list(rows, col)
-			places = get_decimal_places(rows, col)
-			output_row.append(format_float(calc_mean(values), places))
-			output_row.append(format_float(calc_standard_deviation(values), places))
-		elif is_float(rows[0][col]):
-			# other columns that are numbers => average
-			values = get_row_list(rows, col)
-			places = get_decimal_places(rows, col)
-			output_row.append(format_float(calc_mean(values), places))
-		else:
-			# other columns that are not numbers => take first value
-			output_row.append(rows[0][col])
+'''
+Accumulate the rows of one group. Only the selected columns keep all
+values (needed for median and percentiles), all other numerical
+columns only keep a running sum.
+'''
+class Group:
+	def __init__(self, first_row, columns):
+		self.first_row = first_row
+		self.count = 0
+		self.numeric = [is_float(value) for value in first_row]
+		self.sums = [0.0] * len(first_row)
+		self.places = [0] * len(first_row)
+		self.values = {col: [] for col in columns}
+
+	def add(self, row):
+		self.count += 1
+		for col in range(0, len(self.first_row)):
+			if not self.numeric[col]:
+				continue
+			value = row[col]
+			self.places[col] = max(self.places[col], get_places(value))
+			if col in self.values:
+				self.values[col].append(float(value))
+			else:
+				self.sums[col] += float(value)
+
+	def output_row(self, stats):
+		output_row = []
+		for col in range(0, len(self.first_row)):
+			places = self.places[col]
+			if col in self.values:
+				values = sorted(self.values[col])
+				output_row.append(format_float(calc_mean(values), places))
+				for stat in stats:
+					output_row.append(format_float(calc_stat(stat, values), places))
+			elif self.numeric[col]:
+				# other columns that are numbers => average
+				output_row.append(format_float(self.sums[col] / self.count, places))
+			else:
+				# other columns that are not numbers => take first value
+				output_row.append(self.first_row[col])
 
-	return output_row
+		return output_row
 
-def handle_header(header, columns):
+def handle_header(header, columns, stats):
 	output_header = []
 	for col in range(0, len(header)):
-		if (col + 1) in columns:
-			output_header.append(header[col])
-			output_header.append(header[col] + '_sd')
-		else:
-			output_header.append(header[col])
+		output_header.append(header[col])
+		if col in columns:
+			for stat in stats:
+				output_header.append(header[col] + '_' + stat)
 
 	return output_header
 
 '''
-Translate column names to column index number using the CSV header
+Translate column names or numbers to zero based column indices using the CSV header
 '''
 def translate_columns(header, columns):
 	translated = []
 	for value in columns:
-		idx = header.index(value)
-		if idx < 0:
-			if is_int(value):
-				translated.append(int(value))
-			else:
-				print('Cannot find header: {}'.format(value))
-				exit(1)
+		if value in header:
+			translated.append(header.index(value))
+		elif is_int(value):
+			translated.append(int(value) - 1)
 		else:
-			# translated title name to column index
-			translated.append(idx + 1)
+			print('Cannot find header: {}'.format(value))
+			exit(1)
 
 	return translated
 
-dialect = None
-output_header = None
-output_rows = []
+check_stats(args.stats)
 
-with open(args.input, 'r') as file:
-	sample = file.readline()
-	file.seek(0)
+with open(args.input, 'r') as infile, open(args.output, 'w') as outfile:
+	sample = infile.readline()
+	infile.seek(0)
 
 	dialect = csv.Sniffer().sniff(sample, delimiters=";,\t ")
-	reader = csv.reader(file, dialect)
+	reader = csv.reader(infile, dialect)
+	writer = csv.writer(outfile, dialect)
 
+	header = []
 	if csv.Sniffer().has_header(sample):
-		for line in reader:
-			args.column = translate_columns(line, args.column)
-			output_header = handle_header(line, args.column)
-			break
+		header = next(reader)
+
+	columns = translate_columns(header, args.column)
+	if len(header) > 0:
+		writer.writerow(handle_header(header, columns, args.stats))
+
+	if args.span is not None:
+		# rows are streamed, only the current span is kept
+		group = None
+		for row in reader:
+			if group is None:
+				group = Group(row, columns)
+			group.add(row)
+			if group.count == args.span:
+				writer.writerow(group.output_row(args.stats))
+				group = None
+
+		if group is not None:
+			print("Warning: {} lines left => skipped".format(group.count))
 	else:
-		args.column = translate_columns([], args.column)
-
-	rows = []
-	for line in reader:
-		if len(rows) < args.span:
-			rows.append(line)
-		else:
-			# process every <span> rows
-			output_rows.append(handle_rows(rows, args.column))
-			rows = [line]
-
-	if len(rows) == args.span:
-		output_rows.append(handle_rows(rows, args.column))
-	elif len(rows) != 0:
-		print("Warning: {} lines left => skipped".format(len(rows)))
-
-
-with open(args.output, 'w') as file:
-	writer = csv.writer(file, dialect)
-
-	if output_header is not None:
-		writer.writerow(output_header)
-
-	for row in output_rows:
-		writer.writerow(row)
+		# keep accumulated values per group key, in order of appearance
+		keys = translate_columns(header, args.group_by)
+		groups = {}
+		for row in reader:
+			key = tuple(row[col] for col in keys)
+			group = groups.get(key)
+			if group is None:
+				group = Group(row, columns)
+				groups[key] = group
+			group.add(row)
+
+		for group in groups.values():
+			writer.writerow(group.output_row(args.stats))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import argparse
+import math
+import glob
+import sys
+import csv
+import os
+
+
+parser = argparse.ArgumentParser(
+    description='Read the TSV files of test runs (e.g. traffic-batman-adv-lattice4.tsv) and create a SVG chart for every test and data set with a series for each protocol.')
+parser.add_argument('input', nargs='+', help='TSV files or directories containing TSV files.')
+parser.add_argument('--output', default='.', help='Output directory for the charts. Default: current directory')
+parser.add_argument('--prefix', default='', help='Only read files with this prefix (see the prefix argument of run.sh).')
+parser.add_argument('--x', help='Column for the x axis. Default depends on the test (node_count or offset).')
+parser.add_argument('--y', help='Column for the y axis or "arrival" for the packet arrival rate in percent. Default depends on the test.')
+parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of charts rendered in parallel.')
+
+args = parser.parse_args()
+
+protocols = ['none', 'babel', 'batman-adv', 'olsr2', 'bmx6', 'bmx7', 'yggdrasil']
+
+# default axes per test: (x column, y column, x label, y label)
+tests = {
+	'traffic': ('node_count', 'ingress_avg_node_kbs', '# number of nodes', 'kB/s per node (ingress)'),
+	'convergence': ('offset', 'arrival', 'wait after start [sec]', 'packets arrived [%]'),
+}
+
+colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f']
+
+'''
+Split a file name like "run1-traffic-batman-adv-lattice4.tsv"
+into (test, protocol, dataset).
+'''
+def parse_file_name(path):
+	name = os.path.basename(path)[len(args.prefix):-len('.tsv')]
+	for test in tests:
+		if not name.startswith(test + '-'):
+			continue
+		rest = name[len(test) + 1:]
+		for protocol in protocols:
+			if rest.startswith(protocol + '-'):
+				return (test, protocol, rest[len(protocol) + 1:])
+	return None
+
+def get_value(row, column):
+	if column == 'arrival':
+		send = float(row['packets_send'])
+		return 0.0 if send == 0 else (100.0 * float(row['packets_received']) / send)
+	return float(row[column])
+
+'''
+Read a TSV file once and reduce it to a list of (x, mean, standard deviation).
+'''
+def read_series(path, x_column, y_column):
+	groups = {}
+	with open(path, 'r') as file:
+		reader = csv.reader(file, delimiter='\t')
+		header = [title.strip() for title in next(reader, [])]
+		for values in reader:
+			if len(values) != len(header):
+				continue
+			row = dict(zip(header, values))
+			x = get_value(row, x_column)
+			groups.setdefault(x, []).append(get_value(row, y_column))
+
+	series = []
+	for x in sorted(groups):
+		ys = groups[x]
+		mean = math.fsum(ys) / len(ys)
+		sd = 0.0 if len(ys) < 2 else math.sqrt(math.fsum((y - mean) ** 2 for y in ys) / (len(ys) - 1))
+		series.append((x, mean, sd))
+
+	return series
+
+# about five round tick values covering [lo, hi]
+def get_ticks(lo, hi):
+	if hi <= lo:
+		hi = lo + 1.0
+	raw = (hi - lo) / 5.0
+	magnitude = 10 ** math.floor(math.log10(raw))
+	step = magnitude * min((m for m in (1, 2, 5, 10) if m * magnitude >= raw))
+	first = math.floor(lo / step) * step
+	ticks = []
+	i = 0
+	while first + i * step <= hi + step * 1e-9:
+		ticks.append(first + i * step)
+		i += 1
+	if ticks[-1] < hi:
+		ticks.append(ticks[-1] + step)
+	return ticks
+
+def format_tick(value):
+	return '{:g}'.format(round(value, 6))
+
+def escape(s):
+	return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def render_svg(path, title, xlabel, ylabel, all_series):
+	width, height = 1280, 960
+	left, right, top, bottom = 100, 40, 80, 80
+
+	points = [(x, y - sd, y + sd) for series in all_series.values() for (x, y, sd) in series]
+	if len(points) == 0:
+		return
+	xticks = get_ticks(min(p[0] for p in points), max(p[0] for p in points))
+	yticks = get_ticks(min(0.0, min(p[1] for p in points)), max(p[2] for p in points))
+
+	def sx(x):
+		return left + (x - xticks[0]) / (xticks[-1] - xticks[0]) * (width - left - right)
+
+	def sy(y):
+		return height - bottom - (y - yticks[0]) / (yticks[-1] - yticks[0]) * (height - top - bottom)
+
+	out = []
+	out.append('<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="Helvetica, sans-serif">'.format(width, height))
+	out.append('<rect width="100%" height="100%" fill="white"/>')
+	out.append('<text x="{}" y="40" font-size="24" text-anchor="middle">{}</text>'.format(width / 2, escape(title)))
+
+	# grid and tick labels
+	for x in xticks:
+		out.append('<line x1="{0:.1f}" y1="{1}" x2="{0:.1f}" y2="{2}" stroke="#ddd"/>'.format(sx(x), top, height - bottom))
+		out.append('<text x="{:.1f}" y="{}" font-size="14" text-anchor="middle">{}</text>'.format(sx(x), height - bottom + 20, format_tick(x)))
+	for y in yticks:
+		out.append('<line x1="{0}" y1="{1:.1f}" x2="{2}" y2="{1:.1f}" stroke="#ddd"/>'.format(left, sy(y), width - right))
+		out.append('<text x="{}" y="{:.1f}" font-size="14" text-anchor="end">{}</text>'.format(left - 8, sy(y) + 5, format_tick(y)))
+	out.append('<rect x="{}" y="{}" width="{}" height="{}" fill="none" stroke="black"/>'.format(left, top, width - left - right, height - top - bottom))
+	out.append('<text x="{}" y="{}" font-size="18" text-anchor="middle">{}</text>'.format(width / 2, height - 25, escape(xlabel)))
+	out.append('<text x="25" y="{0}" font-size="18" text-anchor="middle" transform="rotate(-90 25 {0})">{1}</text>'.format(height / 2, escape(ylabel)))
+
+	for i, (name, series) in enumerate(all_series.items()):
+		color = colors[i % len(colors)]
+		coords = ' '.join('{:.1f},{:.1f}'.format(sx(x), sy(y)) for (x, y, sd) in series)
+		out.append('<polyline points="{}" fill="none" stroke="{}" stroke-width="3"/>'.format(coords, color))
+		for (x, y, sd) in series:
+			if sd > 0:
+				out.append('<line x1="{0:.1f}" y1="{1:.1f}" x2="{0:.1f}" y2="{2:.1f}" stroke="{3}"/>'.format(sx(x), sy(y - sd), sy(y + sd), color))
+			out.append('<circle cx="{:.1f}" cy="{:.1f}" r="4" fill="{}"/>'.format(sx(x), sy(y), color))
+		# legend
+		ly = top + 30 + i * 30
+		out.append('<line x1="{}" y1="{}" x2="{}" y2="{}" stroke="{}" stroke-width="3"/>'.format(width - right - 190, ly, width - right - 150, ly, color))
+		out.append('<text x="{}" y="{}" font-size="18">{}</text>'.format(width - right - 140, ly + 6, escape(name)))
+
+	out.append('</svg>')
+
+	with open(path, 'w') as file:
+		file.write('\n'.join(out))
+		file.write('\n')
+
+def create_chart(test, dataset, files):
+	(x_column, y_column, xlabel, ylabel) = tests[test]
+	if args.x is not None:
+		x_column = xlabel = args.x
+	if args.y is not None:
+		y_column = ylabel = args.y
+
+	all_series = {}
+	for protocol in protocols:
+		if protocol in files:
+			all_series[protocol] = read_series(files[protocol], x_column, y_column)
+
+	path = os.path.join(args.output, '{}{}-{}.svg'.format(args.prefix, test, dataset))
+	render_svg(path, '{} on {}'.format(test, dataset), xlabel, ylabel, all_series)
+	return path
+
+
+# collect all files: charts[(test, dataset)][protocol] = path
+charts = {}
+for item in args.input:
+	paths = glob.glob(os.path.join(item, '*.tsv')) if os.path.isdir(item) else [item]
+	for path in paths:
+		if not os.path.basename(path).startswith(args.prefix):
+			continue
+		parsed = parse_file_name(path)
+		if parsed is None:
+			continue
+		(test, protocol, dataset) = parsed
+		charts.setdefault((test, dataset), {})[protocol] = path
+
+if len(charts) == 0:
+	sys.stderr.write('No test files found.\n')
+	exit(1)
+
+os.makedirs(args.output, exist_ok=True)
+
+with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+	futures = [executor.submit(create_chart, test, dataset, files) for ((test, dataset), files) in sorted(charts.items())]
+	for future in futures:
+		print('created {}'.format(future.result()))
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+import subprocess
+import threading
+import itertools
+import tempfile
+import shutil
+import argparse
+import datetime
+import resource
+import json
+import glob
+import time
+import sys
+import os
+
+
+parser = argparse.ArgumentParser(
+    description='Run all combinations of topologies, protocols, seeds and test parameters given by a JSON file. Finished jobs are recorded in a checkpoint file, so an interrupted sweep can be resumed.')
+parser.add_argument('spec', help='JSON file that describes the sweep.')
+parser.add_argument('--prefix', default='', help='Prefix for output files (to distinguish multiple runs).')
+parser.add_argument('--checkpoint', help='Checkpoint file. Default: <spec>.checkpoint')
+parser.add_argument('--retry-failed', action='store_true', help='Run jobs again that failed in a previous run.')
+parser.add_argument('--dry-run', action='store_true', help='Only print the jobs in execution order.')
+parser.add_argument('--parallel', type=int, default=1, help='Number of labs (network.py --lab) that run jobs side by side, each on its own share of the CPUs. Default: 1')
+
+args = parser.parse_args()
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+network_py = os.path.join(base_dir, '..', '..', 'network.py')
+tests_py = os.path.join(base_dir, '..', '..', 'tests.py')
+
+'''
+Example sweep specification (paths are relative to the spec file):
+{
+  "topologies": ["../line_data/line-*.json"],
+  "protocols": ["batman-adv", "babel"],
+  "seeds": [42],
+  "runs": 1,
+  "params": {"duration": [60], "samples": [300], "wait": [60]},
+  "output": "traffic-{protocol}-{dataset}.tsv",
+  "settle": 10,
+  "start_wait": 0,
+  "timeout": 600,
+  "sysctl": {"net.ipv6.neigh.default.gc_thresh3": 8192}
+}
+'''
+def load_spec(path):
+	with open(path) as file:
+		spec = json.load(file)
+
+	spec.setdefault('seeds', [None])
+	spec.setdefault('runs', 1)
+	spec.setdefault('params', {})
+	spec.setdefault('output', 'result-{protocol}-{dataset}.tsv')
+	spec.setdefault('settle', 10)
+	spec.setdefault('start_wait', 0)
+	spec.setdefault('timeout', 3600)
+	spec.setdefault('sysctl', {})
+
+	for key in ('topologies', 'protocols'):
+		if key not in spec:
+			print('Missing key in sweep specification: {}'.format(key))
+			exit(1)
+
+	return spec
+
+class Job:
+	def __init__(self, topology, protocol, seed, params, run):
+		self.topology = topology
+		self.protocol = protocol
+		self.seed = seed
+		self.params = params
+		self.run = run
+		# stable identifier for the checkpoint file
+		self.id = '{} {} {} {} {}'.format(
+			os.path.basename(topology), protocol, seed, run,
+			','.join('{}={}'.format(k, v) for k, v in sorted(params.items())))
+
+	# name and node count from file name, e.g. "lattice4-0100.json"
+	def dataset(self):
+		return os.path.basename(self.topology).rsplit('-', 1)[0]
+
+'''
+Get all jobs ordered by topology. All jobs of a topology
+run on the same network that is only built once.
+'''
+def get_jobs(spec, spec_dir):
+	topologies = []
+	for pattern in spec['topologies']:
+		topologies.extend(sorted(glob.glob(os.path.join(spec_dir, pattern))))
+
+	param_names = sorted(spec['params'])
+	param_values = [spec['params'][name] for name in param_names]
+
+	jobs = []
+	for topology in topologies:
+		for protocol in spec['protocols']:
+			for seed in spec['seeds']:
+				for values in itertools.product(*param_values):
+					for run in range(0, spec['runs']):
+						jobs.append(Job(topology, protocol, seed, dict(zip(param_names, values)), run))
+
+	return jobs
+
+def read_checkpoint(path):
+	done = set()
+	failed = set()
+	if os.path.exists(path):
+		with open(path) as file:
+			for line in file:
+				entry = json.loads(line)
+				if entry['status'] == 'done':
+					done.add(entry['job'])
+					failed.discard(entry['job'])
+				else:
+					failed.add(entry['job'])
+	return (done, failed)
+
+def write_checkpoint(file, job, status, duration):
+	file.write(json.dumps({'job': job.id, 'status': status, 'duration': round(duration, 3)}) + '\n')
+	file.flush()
+	os.fsync(file.fileno())
+
+def log(msg):
+	print('{}: {}'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
+	sys.stdout.flush()
+
+class JobError(Exception):
+	pass
+
+def run(command, timeout):
+	try:
+		rc = subprocess.run(command, timeout=timeout).returncode
+	except subprocess.TimeoutExpired:
+		raise JobError('timeout after {}s: {}'.format(timeout, ' '.join(command)))
+	if rc != 0:
+		raise JobError('command failed: {}'.format(' '.join(command)))
+
+'''
+A lab instance that runs jobs one after another. With --parallel,
+every worker has its own lab (namespaces, state files) and CPUs.
+'''
+class Worker:
+	def __init__(self, lab, cpus):
+		self.lab = lab
+		self.cpus = cpus
+		self.jobs = []
+
+	# options for network.py and tests.py
+	def options(self):
+		if self.lab is None:
+			return []
+		return ['--lab', self.lab, '--cpus', self.cpus]
+
+	def log(self, msg):
+		log(msg if self.lab is None else '[{}] {}'.format(self.lab, msg))
+
+'''
+Split the CPUs of this process into count contiguous sets, e.g. "0-7".
+'''
+def get_cpu_sets(count):
+	cpus = sorted(os.sched_getaffinity(0))
+	sets = []
+	for i in range(0, count):
+		part = cpus[i * len(cpus) // count:(i + 1) * len(cpus) // count] or cpus[-1:]
+		sets.append(','.join(str(cpu) for cpu in part))
+	return sets
+
+def build_network(worker, topology, timeout):
+	# clear (just in case)
+	run([network_py] + worker.options() + ['clear'], timeout)
+	run([network_py] + worker.options() + ['change', 'none', topology], timeout)
+
+def clear_network(worker, timeout):
+	subprocess.run([network_py] + worker.options() + ['clear'], timeout=timeout)
+
+def stop_protocol(worker, protocol, timeout):
+	subprocess.run([tests_py] + worker.options() + ['--verbosity', 'verbose', protocol, 'stop'], timeout=timeout)
+
+'''
+Start the protocol of the job, or switch to it if a protocol is
+still running on the same network. Switching also resets the uplinks.
+'''
+def run_job(spec, worker, job, running, outfile):
+	timeout = spec['timeout']
+	command = [tests_py] + worker.options() + ['--verbosity', 'verbose', '--csv-out', outfile]
+	if job.seed is not None:
+		command += ['--seed', str(job.seed)]
+
+	if running is None:
+		run([tests_py] + worker.options() + ['--verbosity', 'verbose', job.protocol, 'start'], timeout)
+	else:
+		run([tests_py] + worker.options() + ['--verbosity', 'verbose', running, 'switch', job.protocol], timeout)
+
+	time.sleep(spec['start_wait'])
+	test_args = []
+	for name, value in sorted(job.params.items()):
+		test_args += ['--{}'.format(name), str(value)]
+	run(command + [job.protocol, 'test'] + test_args, timeout)
+
+# output files and the checkpoint are shared by all workers
+output_lock = threading.Lock()
+
+# set on Ctrl+C, workers stop after the current job and clean up
+stop = threading.Event()
+
+'''
+Append the rows of a job to the output file, without
+the header if the output file already has one.
+'''
+def append_output(path, outfile):
+	with output_lock, open(path, 'r') as source, open(outfile, 'a') as target:
+		header = source.readline()
+		if target.tell() == 0:
+			target.write(header)
+		shutil.copyfileobj(source, target)
+
+'''
+Run the jobs of a worker, returns the number of failed jobs.
+'''
+def run_jobs(spec, worker, checkpoint):
+	built = None
+	running = None
+	failures = 0
+	try:
+		for job in worker.jobs:
+			if stop.is_set():
+				break
+			start = time.monotonic()
+			try:
+				if built != job.topology:
+					if running is not None:
+						stop_protocol(worker, running, spec['timeout'])
+						running = None
+					worker.log('build {}'.format(os.path.basename(job.topology)))
+					built = None
+					build_network(worker, job.topology, spec['timeout'])
+					built = job.topology
+					# wait for network stacks etc. to settle
+					time.sleep(spec['settle'])
+
+				worker.log('start {}'.format(job.id))
+				outfile = os.path.join(spec_dir, args.prefix + spec['output'].format(
+					protocol=job.protocol, dataset=job.dataset(), seed=job.seed, run=job.run))
+				previous = running
+				running = job.protocol
+				if worker.lab is None:
+					run_job(spec, worker, job, previous, outfile)
+				else:
+					# workers can share an output file, rows of a job are appended at once
+					with tempfile.NamedTemporaryFile(suffix='.tsv') as rows:
+						run_job(spec, worker, job, previous, rows.name)
+						append_output(rows.name, outfile)
+				with output_lock:
+					write_checkpoint(checkpoint, job, 'done', time.monotonic() - start)
+			except JobError as e:
+				if stop.is_set():
+					# commands of the job got the Ctrl+C as well
+					break
+				worker.log('failed {}: {}'.format(job.id, e))
+				with output_lock:
+					write_checkpoint(checkpoint, job, 'failed', time.monotonic() - start)
+				failures += 1
+				# network might be in an undefined state => rebuild for next job
+				if running is not None:
+					stop_protocol(worker, running, spec['timeout'])
+					running = None
+				built = None
+	finally:
+		worker.log('cleanup')
+		if running is not None:
+			stop_protocol(worker, running, spec['timeout'])
+		clear_network(worker, spec['timeout'])
+
+	return failures
+
+
+if os.popen('id -u').read().strip() != '0' and not args.dry_run:
+	print('Need to run as root.')
+	exit(1)
+
+spec_path = os.path.abspath(args.spec)
+spec_dir = os.path.dirname(spec_path)
+spec = load_spec(spec_path)
+jobs = get_jobs(spec, spec_dir)
+checkpoint_path = args.checkpoint or (spec_path + '.checkpoint')
+(done, failed) = read_checkpoint(checkpoint_path)
+
+pending = [job for job in jobs if job.id not in done and (args.retry_failed or job.id not in failed)]
+log('{} jobs, {} done, {} failed, {} pending'.format(len(jobs), len(done), len(failed), len(pending)))
+
+if args.dry_run:
+	for job in pending:
+		print(job.id)
+	exit(0)
+
+# need to open more files (especially for traffic measurement processes)
+(soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(4096, hard)), hard))
+
+for (key, value) in spec['sysctl'].items():
+	subprocess.run(['sysctl', '-q', '-w', '{}={}'.format(key, value)])
+
+if args.parallel > 1:
+	workers = [Worker('sweep{}'.format(i), cpus) for (i, cpus) in enumerate(get_cpu_sets(args.parallel))]
+else:
+	workers = [Worker(None, None)]
+
+# all jobs of a topology go to the same worker, the network is built once
+owners = {}
+for job in pending:
+	if job.topology not in owners:
+		owners[job.topology] = workers[len(owners) % len(workers)]
+	owners[job.topology].jobs.append(job)
+
+failures = 0
+with open(checkpoint_path, 'a') as checkpoint:
+	if len(workers) == 1:
+		failures = run_jobs(spec, workers[0], checkpoint)
+	else:
+		results = [0] * len(workers)
+		def run_worker(i):
+			results[i] = run_jobs(spec, workers[i], checkpoint)
+		threads = [threading.Thread(target=run_worker, args=(i,)) for i in range(0, len(workers))]
+		for thread in threads:
+			thread.start()
+		try:
+			for thread in threads:
+				thread.join()
+		except KeyboardInterrupt:
+			log('interrupted, waiting for the workers to clean up')
+			stop.set()
+			for thread in threads:
+				thread.join()
+			raise
+		failures = sum(results)
+
+log('finished, {} failed jobs'.format(failures))
+exit(1 if failures > 0 else 0)